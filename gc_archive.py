@@ -0,0 +1,265 @@
+import argparse
+import bisect
+import os
+import struct
+import threading
+from array import array
+from queue import Queue
+from typing import NamedTuple, Optional
+
+ARCHIVE_PATH = "outputs/hall_of_fame.gca"
+
+ARCHIVE_MAGIC = b"GCHF"
+ARCHIVE_VERSION = 1
+
+# Magic and version at the start of the file
+FILE_HEADER = struct.Struct("<4sI")
+
+# Generation, score, result count, error count or -1 and program length
+RECORD_HEADER = struct.Struct("<qqqqq")
+
+
+class IndexEntry(NamedTuple):
+    generation: int
+    score: int
+    offset: int
+
+
+class ArchiveEntry(NamedTuple):
+    generation: int
+    score: int
+    program: str
+    results: tuple[int, ...]
+    errors: Optional[tuple[int, ...]]
+
+
+def encode_entry(
+    generation: int,
+    score: int,
+    program: str,
+    results: tuple[int, ...],
+    errors: Optional[tuple[int, ...]],
+) -> bytes:
+    encoded = program.encode()
+
+    return (
+        RECORD_HEADER.pack(
+            generation,
+            score,
+            len(results),
+            -1 if errors is None else len(errors),
+            len(encoded),
+        )
+        + array("q", results + (errors or ())).tobytes()
+        + encoded
+    )
+
+
+# Best programs, each stored only when it beats the one before, so both the
+# generations and the scores in the archive only ever go up
+class HallOfFame:
+    def __init__(self, path: str = ARCHIVE_PATH, generation: Optional[int] = 0):
+        self.path = path
+        self.index: list[IndexEntry] = []
+        self.queue: Queue = Queue()
+        self.thread: Optional[threading.Thread] = None
+
+        if os.path.exists(path):
+            self.read_index()
+
+        # A run only keeps what came before the generation it starts from
+        if generation is not None:
+            keep = bisect.bisect_left(
+                [entry.generation for entry in self.index], generation
+            )
+
+            if keep == 0:
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                with open(path, "wb") as f:
+                    f.write(FILE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+            elif keep < len(self.index):
+                with open(path, "r+b") as f:
+                    f.truncate(self.index[keep].offset)
+
+            self.index = self.index[:keep]
+
+        self.best = self.index[-1].score if self.index else None
+
+    def read_index(self) -> None:
+        with open(self.path, "rb") as f:
+            header = f.read(FILE_HEADER.size)
+
+            if (
+                len(header) < FILE_HEADER.size
+                or FILE_HEADER.unpack(header)[0] != ARCHIVE_MAGIC
+            ):
+                raise ValueError(f"{self.path} is not a hall of fame archive")
+
+            version = FILE_HEADER.unpack(header)[1]
+
+            if version != ARCHIVE_VERSION:
+                raise ValueError(f"Unsupported archive version: {version}")
+
+            size = os.fstat(f.fileno()).st_size
+            offset = FILE_HEADER.size
+
+            while offset + RECORD_HEADER.size <= size:
+                f.seek(offset)
+                generation, score, result_count, error_count, length = (
+                    RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                )
+                end = (
+                    offset
+                    + RECORD_HEADER.size
+                    + 8 * (result_count + max(error_count, 0))
+                    + length
+                )
+
+                # The last record may still be being written
+                if end > size:
+                    break
+
+                self.index.append(IndexEntry(generation, score, offset))
+                offset = end
+
+    def read(self, entry: IndexEntry) -> ArchiveEntry:
+        with open(self.path, "rb") as f:
+            f.seek(entry.offset)
+            generation, score, result_count, error_count, length = RECORD_HEADER.unpack(
+                f.read(RECORD_HEADER.size)
+            )
+
+            values = array("q")
+            values.frombytes(f.read(8 * (result_count + max(error_count, 0))))
+
+            return ArchiveEntry(
+                generation,
+                score,
+                f.read(length).decode(),
+                tuple(values[:result_count]),
+                tuple(values[result_count:]) if error_count >= 0 else None,
+            )
+
+    # Best program as of the given generation
+    def at_generation(self, generation: int) -> Optional[IndexEntry]:
+        position = bisect.bisect_right(
+            [entry.generation for entry in self.index], generation
+        )
+
+        return self.index[position - 1] if position > 0 else None
+
+    # First program that reached the given score
+    def at_score(self, score: int) -> Optional[IndexEntry]:
+        position = bisect.bisect_left([entry.score for entry in self.index], score)
+
+        return self.index[position] if position < len(self.index) else None
+
+    # Only compares scores on the calling thread, the writing happens in the
+    # background and the records waiting for it are written together
+    def consider(self, generation: int, individual) -> bool:
+        if self.best is not None and individual.score <= self.best:
+            return False
+
+        self.best = individual.score
+
+        self.queue.put(
+            (
+                generation,
+                individual.score,
+                individual.program,
+                tuple(individual.results or ()),
+                individual.errors,
+            )
+        )
+
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.write, daemon=True)
+            self.thread.start()
+
+        return True
+
+    def write(self) -> None:
+        with open(self.path, "ab") as f:
+            while True:
+                records = [self.queue.get()]
+
+                while not self.queue.empty():
+                    records.append(self.queue.get())
+
+                for record in records:
+                    if record is None:
+                        return
+
+                    self.index.append(IndexEntry(record[0], record[1], f.tell()))
+                    f.write(encode_entry(*record))
+
+                f.flush()
+
+    def close(self) -> None:
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look through the hall of fame")
+    parser.add_argument("--archive", default=ARCHIVE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="Every stored program, oldest first")
+
+    for name, description in [
+        ("show", "Print a program and its results"),
+        ("export", "Write a program to a .gc file"),
+    ]:
+        command = commands.add_parser(name, help=description)
+        command.add_argument(
+            "--generation", type=int, help="Best program as of this generation"
+        )
+        command.add_argument(
+            "--score", type=int, help="First program with at least this score"
+        )
+
+        if name == "export":
+            command.add_argument("output")
+
+    args = parser.parse_args()
+
+    archive = HallOfFame(args.archive, None)
+
+    if args.command == "list":
+        for entry in archive.index:
+            stored = archive.read(entry)
+
+            print(
+                f"Generation {entry.generation}: {entry.score}",
+                f"({len(stored.results)} tests passed)",
+            )
+    else:
+        if args.generation is not None:
+            entry = archive.at_generation(args.generation)
+        elif args.score is not None:
+            entry = archive.at_score(args.score)
+        else:
+            entry = archive.index[-1] if archive.index else None
+
+        if entry is None:
+            parser.exit(1, "No such program in the hall of fame\n")
+
+        stored = archive.read(entry)
+
+        if args.command == "show":
+            print(f"Generation {stored.generation}: {stored.score}")
+            print("Test costs:", *stored.results)
+
+            if stored.errors is not None:
+                print("Test errors:", *stored.errors)
+
+            print()
+            print(stored.program)
+        else:
+            with open(args.output, "w") as f:
+                f.write(stored.program)
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from queue import Empty
+from typing import AsyncIterator, Optional
+
+from gc_evolution import static_fitness, test_score
+from gc_utils import WATCHDOG_INTERVAL, Runner, SharedPopulation
+
+# Batches per worker that may be queued before submitting waits for results
+IN_FLIGHT_PER_WORKER = 4
+
+
+# Results are read from the output queue only when the event loop sees data
+# on its pipe, so nothing here ever blocks the loop on Queue.get
+class AsyncRunner(Runner):
+    def __init__(
+        self, *args, in_flight_per_worker: int = IN_FLIGHT_PER_WORKER, **kwargs
+    ) -> None:
+        super().__init__(*args, **kwargs)
+
+        self.in_flight_per_worker = in_flight_per_worker
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.messages: Optional[asyncio.Queue] = None
+        self.settled: list[int] = []
+        self.lock = asyncio.Lock()
+
+    def start_reading(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.messages = asyncio.Queue()
+
+        self.loop.add_reader(self.output_queue._reader.fileno(), self.read_messages)
+
+    def stop_reading(self) -> None:
+        if self.loop is None:
+            return
+
+        self.loop.remove_reader(self.output_queue._reader.fileno())
+
+        self.loop = None
+        self.messages = None
+
+    def read_messages(self) -> None:
+        while True:
+            try:
+                self.messages.put_nowait(self.output_queue.get(block=False))
+            except Empty:
+                return
+
+    def kill_workers(self) -> None:
+        self.stop_reading()
+
+        super().kill_workers()
+
+    def fail_task(self, task_id: int, index: int) -> None:
+        task = self.pending.get(task_id)
+
+        super().fail_task(task_id, index)
+
+        # The programs run before it won't get a completion message anymore
+        if task is not None and task[0] == "batch":
+            self.settled.extend(range(task[3][0], index + 1))
+
+    def cancel(self) -> None:
+        # Workers can't take tasks for a released population, the ones they
+        # are running finish and their completions are ignored
+        while True:
+            try:
+                self.task_queue.get(block=False)
+            except Empty:
+                break
+
+        self.pending = {}
+        self.settled = []
+
+        self.release_population()
+
+    async def stream(
+        self, programs: list[tuple[str, int]], tests: list[tuple[list[int], list[int]]]
+    ) -> AsyncIterator[tuple[int, list[int]]]:
+        async with self.lock:
+            if self.messages is None:
+                self.start_reading()
+
+            self.release_population()
+
+            self.population = SharedPopulation.create(
+                [program for program, _ in programs], tests, len(tests) + 1
+            )
+            self.population_ids = [program_id for _, program_id in programs]
+
+            chunks = iter(self.chunk_ranges(len(programs)))
+            in_flight = self.in_flight_per_worker * max(len(self.workers), 1)
+
+            try:
+                while True:
+                    while len(self.pending) < in_flight:
+                        chunk = next(chunks, None)
+
+                        if chunk is None:
+                            break
+
+                        self.put_task("batch", self.population.name, chunk, False)
+
+                    if not self.pending and not self.settled:
+                        break
+
+                    if time.monotonic() - self.last_check >= WATCHDOG_INTERVAL:
+                        self.check_workers()
+
+                    settled, self.settled = self.settled, []
+
+                    for index in settled:
+                        yield self.population_ids[index], self.population.result(index)
+
+                    if not self.pending:
+                        continue
+
+                    try:
+                        message = await asyncio.wait_for(
+                            self.messages.get(), WATCHDOG_INTERVAL
+                        )
+                    except asyncio.TimeoutError:
+                        continue
+
+                    task = self.pending.pop(message[1], None)
+
+                    if task is None or task[0] != "batch":
+                        continue
+
+                    for index in range(*task[3]):
+                        yield self.population_ids[index], self.population.result(index)
+            finally:
+                if self.pending:
+                    self.cancel()
+
+                self.population_ids = []
+
+    async def evaluate(
+        self, population: list[str], tests: list[tuple[list[int], list[int]]]
+    ) -> list[int]:
+        fitness_scores = [static_fitness(program) for program in population]
+
+        async for program_id, costs in self.stream(
+            [(program, i) for i, program in enumerate(population)], tests
+        ):
+            fitness_scores[program_id] += test_score(costs)
+
+        return fitness_scores
@@ -0,0 +1,515 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import resource
+import runpy
+import sys
+import time
+from typing import Optional
+
+from gc_evolution import (
+    create_population,
+    deduplicate,
+    evaluate_population,
+    mutate,
+    reproduce,
+    test_results,
+)
+from gc_generator import ProgramGenerator
+from gc_interpreter import Interpreter
+from gc_utils import BACKENDS, RNG, STEP_BUDGET, Runner, available_cpus
+
+BENCHMARK_PATH = "outputs/benchmark.json"
+
+SEED = 0
+
+# Seconds each round of runs of a corpus program should take, the fastest of
+# the rounds is reported
+INTERPRETER_ROUND_TIME = 0.2
+INTERPRETER_ROUNDS = 5
+
+RUNNER_PROGRAMS = 10000
+
+POPULATION_SIZES = [1000, 5000, 10000]
+GENERATIONS = 3
+
+# Slowdown of a metric against the baseline that counts as a regression
+TOLERANCE = 0.1
+
+
+def nested(depth: int) -> str:
+    line = "ADD v0 v1 v0"
+
+    for _ in range(depth):
+        line = f"MULTI ( IF v0 < v2 ( {line} ; NOP ) ; {line} )"
+
+    return line
+
+
+# Programs that stress one part of the interpreter each, with their inputs
+CORPUS = {
+    "arithmetic": (
+        "\n".join(
+            ["SET v0 0", "INPUT v0", "SET v1 7", "SET v2 1"]
+            + [
+                "ADD v0 v1 v2",
+                "MUL v2 v1 v2",
+                "DIV v2 v1 v2",
+                "SUB v2 v0 v2",
+                "MOD v0 v1 v2",
+            ]
+            * 20
+            + ["YIELD v2"]
+        ),
+        [12345],
+    ),
+    "loop": (
+        "\n".join(
+            [
+                "SET v0 0",
+                "INPUT v0",
+                "SET v1 0",
+                "SET v2 0",
+                "SET v3 0",
+                "LOOP v0 v1 ( LOOP v0 v2 ( ADD v3 v1 v3 ) )",
+                "YIELD v3",
+            ]
+        ),
+        [100],
+    ),
+    "nested": (
+        "\n".join(
+            ["SET v0 0", "INPUT v0", "SET v1 1", "SET v2 1000", nested(8), "YIELD v0"]
+        ),
+        [1],
+    ),
+    # Big integers close to the POW limits, paid for by the size costs
+    "pow": (
+        "\n".join(
+            [
+                "SET v0 99999999",
+                "SET v1 100",
+                "SET v2 0",
+                "SET v3 0",
+                "INPUT v3",
+                "SET v4 0",
+                "LOOP v3 v4 ( POW v0 v1 v2 )",
+                "YIELD v2",
+            ]
+        ),
+        [1000],
+    ),
+}
+
+# Test suites the Runner and whole generations are measured on
+SUITES = {
+    "example": runpy.run_path(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "gc_tests.example.py")
+    )["tests"],
+    "sum": [([a, b], [a + b]) for a, b in [(1, 2), (5, 3), (10, 20), (7, 0)]],
+    "countdown": [([n], list(range(n, 0, -1))) for n in [1, 3, 5]],
+}
+
+
+# Counts every command it executes, which the plain Interpreter doesn't spend
+# time on, so the count is taken once and the timing is done without it
+class CountingInterpreter(Interpreter):
+    def __init__(self) -> None:
+        super().__init__(False)
+        self.executed = 0
+
+    def execute_block(self, block):
+        self.executed += len(block)
+
+        return super().execute_block(block)
+
+
+def benchmark_interpreter(round_time: float = INTERPRETER_ROUND_TIME) -> dict:
+    interpreter = Interpreter(False)
+    counter = CountingInterpreter()
+
+    results = {}
+
+    for name, (code, inputs) in CORPUS.items():
+        program = interpreter.compile(code)
+
+        counter.executed = 0
+
+        started = time.perf_counter()
+        counter.execute(counter.compile(code), inputs, STEP_BUDGET)
+        runs = math.ceil(round_time / (time.perf_counter() - started))
+
+        rounds = []
+
+        for _ in range(INTERPRETER_ROUNDS):
+            started = time.perf_counter()
+
+            for _ in range(runs):
+                interpreter.execute(program, inputs, STEP_BUDGET)
+
+            rounds.append(time.perf_counter() - started)
+
+        seconds = min(rounds)
+
+        results[name] = {
+            "instructions": counter.executed,
+            "runs": runs,
+            "seconds": seconds,
+            "instructions_per_second": counter.executed * runs / seconds,
+        }
+
+    return results
+
+
+def benchmark_generator(programs: int = RUNNER_PROGRAMS, seed: int = SEED) -> dict:
+    generator = ProgramGenerator()
+
+    started = time.perf_counter()
+    generator.generate_population(programs, seed)
+    seconds = time.perf_counter() - started
+
+    return {
+        "programs": programs,
+        "seconds": seconds,
+        "programs_per_second": programs / seconds,
+    }
+
+
+# The same seeded programs on 1 to max_workers workers, started before timing
+def benchmark_runner(
+    tests: list[tuple[list[int], list[int]]],
+    max_workers: int,
+    programs: int = RUNNER_PROGRAMS,
+    backend: str = "interpreter",
+    seed: int = SEED,
+) -> list[dict]:
+    RNG.seed(seed)
+    population = [individual.program for individual in create_population(programs)]
+
+    curve = []
+
+    for workers in range(1, max_workers + 1):
+        runner = Runner(Interpreter(False), backend)
+        runner.create_workers(workers)
+
+        started = time.perf_counter()
+        test_results(population, runner, tests)
+        seconds = time.perf_counter() - started
+
+        runner.kill_workers()
+
+        curve.append(
+            {
+                "workers": workers,
+                "seconds": seconds,
+                "programs_per_second": programs / seconds,
+            }
+        )
+
+    return curve
+
+
+# Programs and scores of a whole population, so two runs can be told apart
+def population_digest(population: list) -> str:
+    digest = hashlib.sha256()
+
+    for individual in population:
+        digest.update(f"{individual.score}\n{individual.program}\0".encode())
+
+    return digest.hexdigest()
+
+
+def benchmark_generations(
+    tests: list[tuple[list[int], list[int]]],
+    sizes: list[int],
+    generations: int = GENERATIONS,
+    workers: Optional[int] = None,
+    backend: str = "interpreter",
+    seed: int = SEED,
+) -> list[dict]:
+    runner = Runner(Interpreter(False), backend)
+    runner.create_workers(workers)
+
+    results = []
+
+    for size in sizes:
+        RNG.seed(seed)
+        population = create_population(size)
+
+        digests = []
+        seconds = 0.0
+
+        for _ in range(generations):
+            started = time.perf_counter()
+
+            population, fitness_scores = evaluate_population(population, runner, tests)
+
+            seconds += time.perf_counter() - started
+
+            digests.append(population_digest(population))
+
+            started = time.perf_counter()
+            population = reproduce(
+                deduplicate(population), mutate, None, len(population)
+            )
+            seconds += time.perf_counter() - started
+
+        results.append(
+            {
+                "population": size,
+                "generations": generations,
+                "seconds_per_generation": seconds / generations,
+                "best_score": fitness_scores[0],
+                "digests": digests,
+            }
+        )
+
+    runner.kill_workers()
+
+    return results
+
+
+# Highest resident set size in kilobytes, the workers count once they are joined
+def peak_memory() -> dict:
+    return {
+        "main_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "workers_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+# Every number worth comparing under one name, throughputs end in per_second
+def flatten(report: dict) -> dict[str, float]:
+    metrics = {}
+
+    for name, result in report["interpreter"].items():
+        metrics[f"interpreter.{name}.instructions_per_second"] = result[
+            "instructions_per_second"
+        ]
+
+    # Reports from before the generator was measured don't have it
+    if "generator" in report:
+        metrics["generator.programs_per_second"] = report["generator"][
+            "programs_per_second"
+        ]
+
+    for point in report["runner"]["scaling"]:
+        metrics[f"runner.{point['workers']}_workers.programs_per_second"] = point[
+            "programs_per_second"
+        ]
+
+    for result in report["generations"]["sizes"]:
+        metrics[f"generations.{result['population']}.seconds_per_generation"] = result[
+            "seconds_per_generation"
+        ]
+
+    for name, value in report["peak_memory"].items():
+        metrics[f"peak_memory.{name}"] = value
+
+    return metrics
+
+
+# Changes of every metric both reports have, and which of them got worse by
+# more than the tolerance
+def compare(
+    report: dict, baseline: dict, tolerance: float = TOLERANCE
+) -> tuple[list[str], list[str]]:
+    current = flatten(report)
+    previous = flatten(baseline)
+
+    lines = []
+    regressions = []
+
+    for name, value in current.items():
+        if name not in previous or previous[name] == 0:
+            continue
+
+        change = value / previous[name] - 1
+
+        # Throughput should go up, time and memory down
+        worse = -change if name.endswith("per_second") else change
+
+        line = f"{name}: {previous[name]:.6g} -> {value:.6g} ({change:+.1%})"
+        lines.append(line)
+
+        if worse > tolerance:
+            regressions.append(line)
+
+    return lines, regressions
+
+
+# Population sizes that evolved differently in the two reports, their timings
+# measure different work and can't be compared
+def diverged(report: dict, baseline: dict) -> list[int]:
+    previous = {
+        result["population"]: result.get("digests")
+        for result in baseline["generations"]["sizes"]
+    }
+
+    return [
+        result["population"]
+        for result in report["generations"]["sizes"]
+        if previous.get(result["population"]) not in [None, result["digests"]]
+    ]
+
+
+# Runs the same generations on one worker and on several, the populations have
+# to be the same after every generation for timings to mean anything
+def verify(
+    tests: list[tuple[list[int], list[int]]],
+    sizes: list[int],
+    generations: int,
+    workers: int,
+    backend: str,
+    seed: int,
+) -> bool:
+    runs = [
+        benchmark_generations(tests, sizes, generations, amount, backend, seed)
+        for amount in [1, max(workers, 2)]
+    ]
+
+    identical = True
+
+    for first, second in zip(*runs):
+        for generation, (one, other) in enumerate(
+            zip(first["digests"], second["digests"])
+        ):
+            if one != other:
+                print(
+                    f"Population {first['population']} differs after generation",
+                    generation,
+                )
+                identical = False
+                break
+
+    return identical
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how fast programs evolve")
+    parser.add_argument("--suite", choices=list(SUITES), default="example")
+    parser.add_argument("--backend", choices=BACKENDS, default="interpreter")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=available_cpus(),
+        help="Most workers on the scaling curve (all available CPUs)",
+    )
+    parser.add_argument(
+        "--round-time",
+        type=float,
+        default=INTERPRETER_ROUND_TIME,
+        help="Seconds to run each corpus program for, per round",
+    )
+    parser.add_argument("--programs", type=int, default=RUNNER_PROGRAMS)
+    parser.add_argument(
+        "--populations",
+        default=",".join(str(size) for size in POPULATION_SIZES),
+        help="Population sizes to time generations at, comma separated",
+    )
+    parser.add_argument("--generations", type=int, default=GENERATIONS)
+    parser.add_argument("--output", default=BENCHMARK_PATH)
+    parser.add_argument("--baseline", help="Earlier output to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Only check that runs with different worker counts evolve the same",
+    )
+    args = parser.parse_args()
+
+    # Read first, so a missing baseline doesn't waste a whole run
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    tests = SUITES[args.suite]
+    sizes = [int(size) for size in args.populations.split(",")]
+
+    if args.verify:
+        if not verify(
+            tests, sizes, args.generations, args.workers, args.backend, args.seed
+        ):
+            sys.exit(1)
+
+        print("Every population was the same")
+        sys.exit(0)
+
+    print("Interpreter")
+    interpreter = benchmark_interpreter(args.round_time)
+
+    for name, result in interpreter.items():
+        print(f"  {name}: {result['instructions_per_second']:.0f} instructions/s")
+
+    print("Generator")
+    generator = benchmark_generator(args.programs, args.seed)
+    print(f"  {generator['programs_per_second']:.0f} programs/s")
+
+    print("Runner")
+    scaling = benchmark_runner(
+        tests, args.workers, args.programs, args.backend, args.seed
+    )
+
+    for point in scaling:
+        print(
+            f"  {point['workers']} workers: {point['programs_per_second']:.0f} programs/s"
+        )
+
+    print("Generations")
+    generations = benchmark_generations(
+        tests, sizes, args.generations, args.workers, args.backend, args.seed
+    )
+
+    for result in generations:
+        print(
+            f"  population {result['population']}:",
+            f"{result['seconds_per_generation']:.3f} s/generation",
+        )
+
+    report = {
+        "seed": args.seed,
+        "suite": args.suite,
+        "backend": args.backend,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": available_cpus(),
+        "interpreter": interpreter,
+        "generator": generator,
+        "runner": {"programs": args.programs, "scaling": scaling},
+        "generations": {"sizes": generations},
+        "peak_memory": peak_memory(),
+    }
+
+    print("Peak memory")
+    print(
+        f"  main: {report['peak_memory']['main_kb']} KB,",
+        f"workers: {report['peak_memory']['workers_kb']} KB",
+    )
+
+    if os.path.dirname(args.output) and not os.path.exists(
+        os.path.dirname(args.output)
+    ):
+        os.mkdir(os.path.dirname(args.output))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline is not None:
+        lines, regressions = compare(report, baseline, args.tolerance)
+
+        print(f"Compared to {args.baseline}")
+
+        for size in diverged(report, baseline):
+            print(f"  population {size} evolved differently, its times don't compare")
+
+        for line in lines:
+            print(f"  {line}")
+
+        if regressions:
+            print(
+                f"{len(regressions)} metrics got worse by more than {args.tolerance:.0%}"
+            )
+            sys.exit(1)
@@ -0,0 +1,90 @@
+import hashlib
+import sys
+from collections import OrderedDict
+from typing import Optional
+
+from gc_utils import normalize_program
+
+# Estimated bytes the cached results may take, with every test's error and cost
+# cached entries grow with the tests so a count of them would bound nothing
+FITNESS_CACHE_BYTES = 256 * 2**20
+
+# What an entry costs besides its key and result, the links of the OrderedDict
+# and its share of the hash table
+ENTRY_OVERHEAD = 100
+
+# An int that isn't one of the small shared ones, as the allocator rounds it
+INT_SIZE = 32
+
+
+def suite_key(
+    tests: list[tuple[list[int], list[int]]], budget: int, errors: bool = False
+) -> bytes:
+    return hashlib.blake2b(
+        repr((tests, budget, errors)).encode(), digest_size=16
+    ).digest()
+
+
+def program_key(program: str, suite: bytes) -> bytes:
+    return hashlib.blake2b(
+        normalize_program(program).encode(), digest_size=16, key=suite
+    ).digest()
+
+
+def entry_size(key: bytes, result: tuple[tuple[int, ...], int]) -> int:
+    costs, _ = result
+
+    return (
+        ENTRY_OVERHEAD
+        + sys.getsizeof(key)
+        + sys.getsizeof(result)
+        + sys.getsizeof(costs)
+        + INT_SIZE * (len(costs) + 1)
+    )
+
+
+# Passed test costs and output fingerprints of programs that were already
+# evaluated, least recently used entries are dropped once they take more than
+# an estimated max_bytes
+class FitnessCache:
+    def __init__(self, max_bytes: int = FITNESS_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.results: OrderedDict[bytes, tuple[tuple[int, ...], int]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def get(self, key: bytes) -> Optional[tuple[tuple[int, ...], int]]:
+        result = self.results.get(key)
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.results.move_to_end(key)
+
+        return result
+
+    def put(self, key: bytes, result: tuple[tuple[int, ...], int]) -> None:
+        replaced = self.results.get(key)
+
+        if replaced is not None:
+            self.size -= entry_size(key, replaced)
+
+        self.results[key] = result
+        self.results.move_to_end(key)
+        self.size += entry_size(key, result)
+
+        while self.size > self.max_bytes and self.results:
+            dropped = self.results.popitem(last=False)
+            self.size -= entry_size(*dropped)
+
+    def clear(self) -> None:
+        self.results.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,206 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import NamedTuple, Optional
+
+from gc_evolution import Individual
+from gc_utils import RNG, Runner
+
+# Generations between checkpoints
+CHECKPOINT_INTERVAL = 10
+
+CHECKPOINT_PATH = "outputs/checkpoint.gcc"
+
+CHECKPOINT_MAGIC = b"GCCP"
+CHECKPOINT_VERSION = 1
+
+# Magic, version, generation, program count, row width and metadata length
+HEADER = struct.Struct("<4sIqqqq")
+
+
+class Checkpoint(NamedTuple):
+    generation: int
+    population: list[Individual]
+    tests: list[tuple[list[int], list[int]]]
+    config: dict
+    random_state: tuple
+
+
+# What a resumed run needs to evaluate programs the same way, as Runner arguments
+def runner_config(runner: Runner) -> dict:
+    return {
+        "backend": runner.backend,
+        "budget": runner.budget,
+        "optimize": runner.optimize,
+    }
+
+
+# A header, the metadata as JSON padded to 8 bytes, the program offsets, one
+# fixed-width row per individual (dirty, score, result count, results, error
+# count or -1, errors) and the encoded programs
+def encode_checkpoint(
+    generation: int,
+    records: list[tuple[str, Optional[int], Optional[tuple], Optional[tuple]]],
+    tests: list[tuple[list[int], list[int]]],
+    config: dict,
+    random_state: tuple,
+) -> bytes:
+    metadata = json.dumps(
+        {"tests": tests, "config": config, "random_state": random_state}
+    ).encode()
+    metadata += b" " * (-len(metadata) % 8)
+
+    width = 4 + max(
+        [len(results or ()) + len(errors or ()) for _, _, results, errors in records]
+        + [0]
+    )
+
+    offsets = array("q", [0])
+    rows = array("q")
+    data = []
+
+    for program, score, results, errors in records:
+        encoded = program.encode()
+        data.append(encoded)
+        offsets.append(offsets[-1] + len(encoded))
+
+        results = results or ()
+        row = [int(score is None), score or 0, len(results), *results]
+
+        if errors is None:
+            row.append(-1)
+        else:
+            row.append(len(errors))
+            row.extend(errors)
+
+        rows.extend(row)
+        rows.extend([0] * (width - len(row)))
+
+    return b"".join(
+        [
+            HEADER.pack(
+                CHECKPOINT_MAGIC,
+                CHECKPOINT_VERSION,
+                generation,
+                len(records),
+                width,
+                len(metadata),
+            ),
+            metadata,
+            offsets.tobytes(),
+            rows.tobytes(),
+        ]
+        + data
+    )
+
+
+# Written next to the checkpoint first, so a crash can't leave half of one
+def write_checkpoint(path: str, *state) -> None:
+    encoded = encode_checkpoint(*state)
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(encoded)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path: str = CHECKPOINT_PATH) -> Checkpoint:
+    with open(path, "rb") as f:
+        memory = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with memory:
+        magic, version, generation, count, width, metadata_length = HEADER.unpack_from(
+            memory
+        )
+
+        if magic != CHECKPOINT_MAGIC:
+            raise ValueError(f"{path} is not a checkpoint")
+
+        if version != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version: {version}")
+
+        metadata_end = HEADER.size + metadata_length
+        offsets_end = metadata_end + 8 * (count + 1)
+        rows_end = offsets_end + 8 * count * width
+
+        metadata = json.loads(bytes(memory[HEADER.size : metadata_end]))
+
+        offsets = array("q", memory[metadata_end:offsets_end])
+        rows = array("q", memory[offsets_end:rows_end])
+
+        population = []
+
+        for index in range(count):
+            row = rows[index * width : (index + 1) * width]
+            program = memory[
+                rows_end + offsets[index] : rows_end + offsets[index + 1]
+            ].decode()
+
+            results = tuple(row[3 : 3 + row[2]])
+            error_count = row[3 + row[2]]
+            errors = None
+
+            if error_count >= 0:
+                errors = tuple(row[4 + row[2] : 4 + row[2] + error_count])
+
+            # Genomes are only parsed for the programs that get mutated
+            if row[0]:
+                population.append(Individual(None, text=program))
+            else:
+                population.append(
+                    Individual(None, row[1], results, errors, text=program)
+                )
+
+    version, state, gauss_next = metadata["random_state"]
+
+    return Checkpoint(
+        generation,
+        population,
+        [tuple(test) for test in metadata["tests"]],
+        metadata["config"],
+        (version, tuple(state), gauss_next),
+    )
+
+
+# Only a snapshot of the population is taken on the calling thread, encoding
+# and writing it happens in the background while the next generation runs
+class CheckpointWriter:
+    def __init__(self, path: str = CHECKPOINT_PATH) -> None:
+        self.path = path
+        self.thread: Optional[threading.Thread] = None
+
+    def save(
+        self,
+        generation: int,
+        population: list[Individual],
+        tests: list[tuple[list[int], list[int]]],
+        config: dict,
+    ) -> None:
+        # One write at a time, so checkpoints are replaced in order
+        self.wait()
+
+        records = [
+            (
+                individual.program,
+                None if individual.dirty else individual.score,
+                individual.results,
+                individual.errors,
+            )
+            for individual in population
+        ]
+
+        self.thread = threading.Thread(
+            target=write_checkpoint,
+            args=(self.path, generation, records, tests, config, RNG.getstate()),
+        )
+        self.thread.start()
+
+    def wait(self) -> None:
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
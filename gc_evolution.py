@@ -1,15 +1,16 @@
 import math
-import random
-from typing import Callable
+from typing import Callable, Optional
 
-from gc_generator import ProgramGenerator
+from gc_cache import FitnessCache, program_key, suite_key
+from gc_generator import GeneratorProcess, ProgramGenerator, random_length
+from gc_genome import Genome, Line
 from gc_interpreter import Interpreter
+from gc_selection import LEXICASE_SELECTIONS, SELECTIONS, top_k
 from gc_utils import (
+    NO_FINGERPRINT,
+    RNG,
     Runner,
-    random_inverse_square,
-    get_variables,
-    split_command,
-    combine_command,
+    seed_rng,
 )
 
 
@@ -29,18 +30,81 @@ MUTATE_SUBCOMMAND_CHANCES = [
 
 REMUTATE_CHANCE = 0.6
 
+ACTION_WEIGHTS: dict[str, float] = {}  # How likely each action is in new lines (1)
+
 
 SURVIVE_TOP = 0.1  # Top from previous gen
 SURVIVE_RANDOM = 0.20  # Random from previous gen
+SURVIVOR_SELECTION = "uniform"  # uniform, tournament or proportional
+PARENT_SELECTION = "survivors"  # survivors, lexicase or epsilon_lexicase
 NEW_RANDOM = 0.25
 
 SCORE_PER_TEST = 100
-RUNTIME_PENALTY_MULTIPLIER = 10000
+COST_PENALTY_MULTIPLIER = 0.02
+
+DUPLICATE_QUOTA: Optional[int] = None  # Parents with the same outputs (any)
+
+# Shared by all mutations, so its tables of actions are only built once
+GENERATOR = ProgramGenerator(weights=ACTION_WEIGHTS)
+
+
+class Individual:
+    def __init__(
+        self,
+        genome: Optional[Genome],
+        score: Optional[int] = None,
+        results: Optional[tuple[int, ...]] = None,
+        errors: Optional[tuple[int, ...]] = None,
+        text: Optional[str] = None,
+    ) -> None:
+        # Either the genome or the text may be missing, each is made from the
+        # other only when it is needed
+        self.parsed = genome
+        self.text = text
+        # Fitness score, and the costs of the tests passed before the first
+        # failed one, both only valid while the individual isn't dirty
+        self.score = score
+        self.results = results
+        # Error on every test, only there when parents are picked by lexicase
+        self.errors = errors
+        self.dirty = score is None
+        # Hash of the outputs on the tests it ran, once it was evaluated
+        self.fingerprint: Optional[int] = None
+
+    @property
+    def genome(self) -> Genome:
+        if self.parsed is None:
+            self.parsed = Genome.parse(self.text)
+
+        return self.parsed
+
+    # Text is only rendered once, for the workers and the output files
+    @property
+    def program(self) -> str:
+        if self.text is None:
+            self.text = self.genome.render()
+
+        return self.text
+
+    def mutated(self, mutation_function) -> "Individual":
+        genome = self.genome.copy()
+
+        if not mutation_function(genome):
+            # Unchanged, so whatever is known about it still holds
+            individual = Individual(
+                genome, self.score, self.results, self.errors, self.text
+            )
+            individual.fingerprint = self.fingerprint
+
+            return individual
 
+        return Individual(genome)
 
-def create_population(n=100, length_function=lambda: int(random_inverse_square() * 3)):
-    generator = ProgramGenerator()
-    return [generator.generate_program(length_function()) for x in range(n)]
+
+def create_population(n=100, length_function=random_length):
+    programs = GENERATOR.generate_population(n, RNG.getrandbits(64), length_function)
+
+    return [Individual(None, text=program) for program in programs]
 
 
 def static_fitness(program: str) -> int:
@@ -62,173 +126,386 @@ def static_fitness(program: str) -> int:
 
 
 def fitness(
-    population: list[str], runner: Runner, tests: list[tuple[list[int], list[int]]]
+    population: list["Individual"],
+    runner: Runner,
+    tests: list[tuple[list[int], list[int]]],
+    cache: Optional[FitnessCache] = None,
 ) -> list[int]:
+    # Programs that reproduced unchanged keep the score they already have
+    dirty = [individual for individual in population if individual.dirty]
+    programs = [individual.program for individual in dirty]
+    errors = PARENT_SELECTION != "survivors"
+
+    if cache is None:
+        results = test_results(programs, runner, tests, errors)
+    else:
+        results = cached_test_results(programs, runner, tests, cache, errors)
+
+    for individual, (result, fingerprint) in zip(dirty, results):
+        if errors:
+            individual.errors = result[: len(tests)]
+            costs = passed_costs(result, len(tests))
+        else:
+            costs = result
+
+        individual.results = costs
+        individual.fingerprint = fingerprint
+        individual.score = static_fitness(individual.program) + test_score(costs)
+        individual.dirty = False
+
+    return [individual.score for individual in population]
+
+
+def cached_test_results(
+    population: list[str],
+    runner: Runner,
+    tests: list[tuple[list[int], list[int]]],
+    cache: FitnessCache,
+    errors: bool = False,
+) -> list[tuple[tuple[int, ...], int]]:
+    suite = suite_key(tests, runner.budget, errors)
+    keys = [program_key(program, suite) for program in population]
+
+    results: dict[bytes, tuple[tuple[int, ...], int]] = {}
+    unseen: dict[bytes, str] = {}
+
+    for program, key in zip(population, keys):
+        if key in results or key in unseen:
+            continue
+
+        result = cache.get(key)
+
+        if result is None:
+            unseen[key] = program
+        else:
+            results[key] = result
+
+    for key, result in zip(
+        unseen, test_results(list(unseen.values()), runner, tests, errors)
+    ):
+        cache.put(key, result)
+        results[key] = result
+
+    return [results[key] for key in keys]
+
+
+# Costs of the tests each program passed before its first failed one, or with
+# errors the error and cost of every test, and the fingerprint of its outputs
+def test_results(
+    population: list[str],
+    runner: Runner,
+    tests: list[tuple[list[int], list[int]]],
+    errors: bool = False,
+) -> list[tuple[tuple[int, ...], int]]:
     survivors: list[tuple[str, int]] = [
         (program, i) for i, program in enumerate(population)
     ]
 
-    fitness_scores = [0] * len(population)
+    results = [((), NO_FINGERPRINT)] * len(population)
 
-    for program_id, program in enumerate(population):
-        fitness_scores[program_id] += static_fitness(program)
+    # Workers stop running a program at its first failed test
+    runner.queue_batches(survivors, tests, errors)
 
-    for test in tests:
-        input = test[0]
+    runner.collect_results()
 
-        runner.queue_test(survivors, input)
+    for program_id, costs in runner.results.items():
+        results[program_id] = (tuple(costs), runner.fingerprints[program_id])
 
-        runner.collect_results()
+    return results
 
-        target = test[1]
 
-        survivors = []
+# Scores stay the same as without errors, only the leading passed tests count
+def passed_costs(result: tuple[int, ...], count: int) -> tuple[int, ...]:
+    costs = []
 
-        for program_id, (output, runtime) in runner.results.items():
-            if output != target:
-                continue
+    for error, cost in zip(result[:count], result[count:]):
+        if error != 0:
+            break
 
-            fitness_scores[program_id] += SCORE_PER_TEST
-            fitness_scores[program_id] -= math.ceil(
-                runtime * RUNTIME_PENALTY_MULTIPLIER
-            )
+        costs.append(cost)
+
+    return tuple(costs)
 
-            survivors.append((population[program_id], program_id))
 
-    return fitness_scores
+def test_score(costs: list[int]) -> int:
+    fitness_score = 0
+
+    for cost in costs:
+        fitness_score += SCORE_PER_TEST
+        fitness_score -= math.ceil(cost * COST_PENALTY_MULTIPLIER)
+
+    return fitness_score
+
+
+# Keeps the first quota programs of every fingerprint, the rest only gave the
+# same outputs as those on the tests they ran, so they aren't parents
+def deduplicate(
+    population: list["Individual"], quota: Optional[int] = DUPLICATE_QUOTA
+) -> list["Individual"]:
+    if quota is None:
+        return population
+
+    counts = {}
+    unique = []
+
+    # In the order of evaluate_population, so the best of every fingerprint
+    for individual in population:
+        fingerprint = individual.fingerprint
+
+        # Unknown when it was killed, or loaded from a checkpoint
+        if fingerprint is not None and fingerprint != NO_FINGERPRINT:
+            counts[fingerprint] = counts.get(fingerprint, 0) + 1
+
+            if counts[fingerprint] > quota:
+                continue
+
+        unique.append(individual)
+
+    return unique
 
 
 def evaluate_population(
-    population: list[str], runner: Runner, tests: list[tuple[list[int], list[int]]]
-) -> tuple[list[str], list[int]]:
-    fitness_scores = fitness(population, runner, tests)
-
-    return [
-        program
-        for _, program in sorted(
-            zip(fitness_scores, population),
-            reverse=True,
-        )
-    ], sorted(fitness_scores, reverse=True)
+    population: list["Individual"],
+    runner: Runner,
+    tests: list[tuple[list[int], list[int]]],
+    cache: Optional[FitnessCache] = None,
+) -> tuple[list["Individual"], list[int]]:
+    fitness_scores = fitness(population, runner, tests, cache)
+
+    # Only the top survivors have to be in order, and the three best that get
+    # printed, reproduce samples the rest
+    with runner.telemetry.stage("sort"):
+        best = top_k(fitness_scores, max(math.ceil(len(population) * SURVIVE_TOP), 3))
+        chosen = set(best)
+        order = best + [i for i in range(len(population)) if i not in chosen]
 
+    return [population[i] for i in order], [fitness_scores[i] for i in order]
 
-def mutate(program: str):
-    should_mutate = random.random() < MUTATE_CHANCE
 
-    if not should_mutate:
-        return program
+# Edits the genome in place, returns False when it was left as it was
+def mutate(genome: Genome) -> bool:
+    mutated = False
 
-    program_lines = program.split("\n")
+    # Every mutation after the first has to pass both chances, like the first
+    while RNG.random() < MUTATE_CHANCE:
+        mutate_line(genome)
+        mutated = True
 
-    action = random.choices(
+        should_mutate_again = RNG.random() < REMUTATE_CHANCE
+
+        if not should_mutate_again:
+            break
+
+    return mutated
+
+
+def mutate_line(genome: Genome):
+    action = RNG.choices(
         ["add_line", "remove_line", "modify_line"], MUTATE_ACTION_CHANCES
     )[0]
 
-    if len(program_lines) == 1 and action == "remove_line":
-        action = random.choices(["add_line", "modify_line"], MUTATE_FALLBACK_CHANCES)[0]
+    if len(genome) == 1 and action == "remove_line":
+        action = RNG.choices(["add_line", "modify_line"], MUTATE_FALLBACK_CHANCES)[0]
+
+    if len(genome) == 0:
+        action = "add_line"
 
-    line = random.randint(0, program.count("\n"))
+    line = RNG.randint(0, max(len(genome) - 1, 0))
 
-    old_line = split_command(program_lines[line].split())
+    old_line = genome.lines[line] if len(genome) > 0 else None
 
     if (
         action in ["remove_line", "modify_line"]
-        and old_line[0][0] == "SET"
-        and program.count(old_line[0][1]) > 1
+        and old_line.action == "SET"
+        and genome.uses.get(old_line.args[0], 0) > 1
     ):
         action = "add_line"
-        line = random.randint(0, program.count("\n"))
-        old_line = split_command(program_lines[line].split())
+        line = RNG.randint(0, len(genome) - 1)
+        old_line = genome.lines[line]
 
-    variables = get_variables("\n".join(program_lines[:line]))
+    variables = sorted(genome.variables_before(line))
 
-    generator = ProgramGenerator(variables)
+    generator = GENERATOR
+    generator.variables = list(variables)
 
-    new_line = generator.generate_line().split()
+    new_line = generator.generate_node()
 
-    if new_line[0] == "SET":
-        new_line[1] = (
-            f"v{max([int(var[1:]) for var in get_variables(program)] + [0]) + 1}"
-        )
-
-    new_line = " ".join(new_line)
+    if new_line.action == "SET":
+        new_line = Line.create("SET", (genome.next_variable(), new_line.args[1]))
 
     if action == "add_line":
-        program_lines.insert(line, new_line)
+        genome.insert(line, new_line)
     elif action == "remove_line":
-        program_lines.pop(line)
+        genome.remove(line)
     elif action == "modify_line":
-        if len(old_line[1]) == 0:
-            program_lines[line] = new_line
+        if len(old_line.blocks) == 0:
+            genome.replace(line, new_line)
         else:
-            modify_action = random.choices(
+            modify_action = RNG.choices(
                 ["replace", "replace_subcommand", "pop_out"], MUTATE_SUBCOMMAND_CHANCES
             )[0]
 
             if modify_action == "replace":
-                program_lines[line] = new_line
+                genome.replace(line, new_line)
             elif modify_action == "replace_subcommand":
-                subcommand = random.randrange(0, len(old_line[1]))
-
-                generator = ProgramGenerator(variables)
+                subcommand = RNG.randrange(0, len(old_line.blocks))
 
-                new_line = generator.generate_line(1)
+                generator.variables = list(variables)
 
-                old_line[1][subcommand] = new_line.split()
+                blocks = list(old_line.blocks)
+                blocks[subcommand] = generator.generate_node(1)
 
-                program_lines[line] = " ".join(combine_command(*old_line))
+                genome.replace(
+                    line, Line.create(old_line.action, old_line.args, tuple(blocks))
+                )
             elif modify_action == "pop_out":
-                program_lines[line] = " ".join(random.choice(old_line[1]))
-
-    should_mutate_again = random.random() < REMUTATE_CHANCE
-
-    result = "\n".join(program_lines)
+                block = RNG.choice(old_line.blocks)
 
-    if should_mutate_again:
-        return mutate(result)
-
-    return result
+                if block is not None:
+                    genome.replace(line, block)
 
 
+# The next generation has size programs, as many as the population if not
+# given, also when deduplicate left fewer to choose the parents from
 def reproduce(
-    population: list[str],
+    population: list[Individual],
     mutation_function,
+    generator_process: Optional[GeneratorProcess] = None,
+    size: Optional[int] = None,
 ):
-    survived_top = math.ceil(len(population) * SURVIVE_TOP)
-    survived_random = math.ceil(len(population) * SURVIVE_RANDOM)
-    new_programs = math.ceil(len(population) * NEW_RANDOM)
+    if size is None:
+        size = len(population)
 
-    reproducing_programs = population[:survived_top] + random.sample(
-        population[survived_top:], survived_random
+    survived_top = min(math.ceil(size * SURVIVE_TOP), len(population))
+    survived_random = min(
+        math.ceil(size * SURVIVE_RANDOM), len(population) - survived_top
     )
+    new_programs = math.ceil(size * NEW_RANDOM)
+
+    # The new programs come from this seed wherever they are generated, the
+    # process makes them while the parents are being mutated
+    seed = RNG.getrandbits(64)
+
+    if generator_process is not None:
+        generator_process.request(new_programs, seed)
+
+    # Deduplicate may have dropped some of the best, which moves unsorted
+    # programs into the ordered top of evaluate_population
+    top = top_k([individual.score for individual in population], survived_top)
+
+    if PARENT_SELECTION == "survivors":
+        chosen = set(top)
+        rest = [
+            individual for i, individual in enumerate(population) if i not in chosen
+        ]
+        selected = SELECTIONS[SURVIVOR_SELECTION](
+            [individual.score for individual in rest], survived_random
+        )
+
+        reproducing_programs = [population[i] for i in top] + [
+            rest[i] for i in selected
+        ]
+    else:
+        # Every other parent is picked on its own, by the cases it is best at
+        selected = LEXICASE_SELECTIONS[PARENT_SELECTION](
+            [individual.errors for individual in population],
+            size - new_programs - survived_top,
+        )
+
+        reproducing_programs = [population[i] for i in top] + [
+            population[i] for i in selected
+        ]
 
     new_population = []
 
-    for i in range(len(population) - new_programs):
+    for i in range(size - new_programs):
         new_population.append(
-            mutation_function(reproducing_programs[i % len(reproducing_programs)])
+            reproducing_programs[i % len(reproducing_programs)].mutated(
+                mutation_function
+            )
         )
 
-    new_population.extend(create_population(new_programs))
+    if generator_process is None:
+        programs = GENERATOR.generate_population(new_programs, seed)
+    else:
+        programs = generator_process.get()
+
+    new_population.extend([Individual(None, text=program) for program in programs])
 
     return new_population
 
 
 if __name__ == "__main__":
-    population = create_population(10000)
-
-    generation = 0
+    import argparse
+
+    from gc_archive import HallOfFame
+    from gc_checkpoint import (
+        CHECKPOINT_INTERVAL,
+        CHECKPOINT_PATH,
+        CheckpointWriter,
+        load_checkpoint,
+        runner_config,
+    )
+    from gc_telemetry import Telemetry
+
+    parser = argparse.ArgumentParser(description="Evolve programs for gc_tests.py")
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const=CHECKPOINT_PATH,
+        help=f"Continue from a checkpoint ({CHECKPOINT_PATH})",
+    )
+    parser.add_argument(
+        "--telemetry", help="Append per generation metrics to this file"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed the run, so it can be repeated (ignored on resume)",
+    )
+    args = parser.parse_args()
 
     interpreter = Interpreter(False)
 
-    runner = Runner(interpreter)
+    telemetry = Telemetry(args.telemetry)
+
+    if args.resume is None:
+        from gc_tests import tests
+
+        seed_rng(args.seed)
+
+        with telemetry.stage("create_population"):
+            population = create_population(10000)
+
+        generation = 0
+
+        runner = Runner(interpreter, telemetry=telemetry)
+    else:
+        checkpoint = load_checkpoint(args.resume)
+
+        population = checkpoint.population
+        tests = checkpoint.tests
 
-    runner.create_workers(1)
+        generation = checkpoint.generation
 
-    from gc_tests import tests
+        RNG.setstate(checkpoint.random_state)
+
+        runner = Runner(interpreter, **checkpoint.config, telemetry=telemetry)
+
+    runner.create_workers()
+
+    generator_process = GeneratorProcess(ACTION_WEIGHTS)
+
+    cache = FitnessCache()
+
+    writer = CheckpointWriter()
+
+    hall_of_fame = HallOfFame(generation=generation)
 
     while True:
-        population, fitness_scores = evaluate_population(population, runner, tests)
+        population, fitness_scores = evaluate_population(
+            population, runner, tests, cache
+        )
 
         print(
             f"Best of generation {generation}:",
@@ -237,9 +514,20 @@ if __name__ == "__main__":
             fitness_scores[2],
         )
 
-        with open(f"outputs/g{generation}.gc", "w") as f:
-            f.write(population[0])
+        with telemetry.stage("output"):
+            hall_of_fame.consider(generation, population[0])
+
+        # Reproducing and checkpointing count towards the next generation
+        telemetry.emit(generation, population, fitness_scores, runner)
 
-        population = reproduce(population, mutate)
+        with telemetry.stage("deduplicate"):
+            parents = deduplicate(population)
+
+        with telemetry.stage("reproduce"):
+            population = reproduce(parents, mutate, generator_process, len(population))
 
         generation += 1
+
+        if generation % CHECKPOINT_INTERVAL == 0:
+            with telemetry.stage("output"):
+                writer.save(generation, population, tests, runner_config(runner))
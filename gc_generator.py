@@ -1,10 +1,29 @@
-import random
+import bisect
 import itertools
+import random
+from multiprocessing import Process, Queue
+from typing import Callable, Optional
+
+from gc_genome import Genome, Line
+from gc_utils import RNG, random_inverse_square
+
+COMPARISONS = [">", ">=", "=", "<=", "<", "!="]
+
+
+def random_length(rng: random.Random) -> int:
+    return int(random_inverse_square(rng) * 3)
 
 
 class ProgramGenerator:
-    def __init__(self, variables: set[str] = set()):
-        self.variables = variables
+    def __init__(
+        self,
+        variables: set[int] = set(),
+        rng: random.Random = RNG,
+        weights: dict[str, float] = {},
+    ):
+        # Kept sorted, so picking one doesn't depend on how a set stores them
+        self.variables = sorted(variables)
+        self.rng = rng
         self.actions: dict[int, list[tuple[str, list[str]]]] = {
             0: [("SET", []), ("NOP", [])],
             1: [
@@ -33,72 +52,151 @@ class ProgramGenerator:
                 ("POW", ["var", "var", "var"]),
             ],
         }
+        # How likely each action is compared to the others, 1 if not given
+        self.weights = weights
+        self.most_variables = max(self.actions)
+        # The actions to pick from and their cumulative weights, by how many
+        # variables there are to use and whether the command is nested, where
+        # SET isn't allowed
+        self.tables = {
+            (count, nested): self.build_table(count, nested)
+            for count in range(self.most_variables + 1)
+            for nested in [False, True]
+        }
 
-    def generate_action(self, max_variables, blacklist):
-        return random.choice(
-            list(
-                itertools.chain(
-                    *[
-                        filter(lambda x: x[0] not in blacklist, self.actions[x])
-                        for x in self.actions.keys()
-                        if x <= max_variables
-                    ]
-                )
-            )
+    def build_table(
+        self, count: int, nested: bool
+    ) -> tuple[list[tuple[str, list[str]]], list[float]]:
+        actions = [
+            action
+            for arity, options in self.actions.items()
+            if arity <= count
+            for action in options
+            if not (nested and action[0] == "SET")
+        ]
+
+        return actions, list(
+            itertools.accumulate(self.weights.get(action, 1) for action, _ in actions)
         )
 
-    def generate_line(self, depth=0):
-        action, arg_types = self.generate_action(
-            len(self.variables), ["SET"] if depth > 0 else []
-        )
+    def generate_action(self, variable_count: int, nested: bool = False):
+        actions, weights = self.tables[
+            (min(variable_count, self.most_variables), nested)
+        ]
+
+        return actions[bisect.bisect(weights, self.rng.random() * weights[-1])]
+
+    def generate_node(self, depth=0) -> Line:
+        action, arg_types = self.generate_action(len(self.variables), depth > 0)
 
         if action == "SET":
-            var_name = f"v{len(self.variables)}"
+            variable = len(self.variables)
 
-            line = f"{action} {var_name} {self.generate_variable_start()}"
+            line = Line.create(action, (variable, str(self.generate_variable_start())))
 
-            self.add_variable(var_name)
+            self.add_variable(variable)
 
         else:
             args = []
+            blocks = []
 
             for arg_type in arg_types:
                 if arg_type == "var":
                     args.append(self.generate_argument())
                 elif arg_type == "cmd":
-                    args.extend(self.generate_line(depth + 1).split())
-                elif arg_type == "cob":
-                    args.append("(")
-                elif arg_type == "cse":
-                    args.append(";")
-                elif arg_type == "ccb":
-                    args.append(")")
+                    blocks.append(self.generate_node(depth + 1))
                 elif arg_type == "cmp":
-                    args.append(random.choice([">", ">=", "=", "<=", "<", "!="]))
+                    args.append(COMPARISONS[int(self.rng.random() * len(COMPARISONS))])
 
-            line = f"{action} {' '.join(args)}"
+            line = Line.create(action, tuple(args), tuple(blocks))
 
         return line
 
+    def generate_line(self, depth=0):
+        return self.generate_node(depth).text
+
     def generate_variable_start(self):
-        return random.randrange(1, 10)
+        return 1 + int(self.rng.random() * 9)
 
-    def generate_program(self, num_lines):
-        program = ""
-        for _ in range(num_lines):
-            program += self.generate_line() + "\n"
+    def generate_genome(self, num_lines) -> Genome:
+        genome = Genome([self.generate_node() for _ in range(num_lines)])
+
+        self.variables = []
 
-        self.variables = set()
+        return genome
 
-        program = program[:-1]
+    def generate_program(self, num_lines):
+        return self.generate_genome(num_lines).render()
+
+    # Whole programs, from a stream of their own seeded with the given seed, so
+    # the same programs come out in whichever process they are generated. Only
+    # the text is made, genomes are parsed from it when they are needed.
+    def generate_population(
+        self,
+        n: int,
+        seed: Optional[int] = None,
+        length_function: Callable[[random.Random], int] = random_length,
+    ) -> list[str]:
+        rng = self.rng
+        self.rng = random.Random(seed)
+
+        programs = []
+
+        try:
+            for _ in range(n):
+                # Left over from whatever the generator made before otherwise
+                self.variables = []
+
+                programs.append(
+                    "\n".join(
+                        [
+                            self.generate_node().text
+                            for _ in range(length_function(self.rng))
+                        ]
+                    )
+                )
+        finally:
+            self.rng = rng
 
-        return program
+        return programs
 
     def add_variable(self, var_name):
-        self.variables.add(var_name)
+        if var_name not in self.variables:
+            bisect.insort(self.variables, var_name)
 
     def generate_argument(self):
-        return random.choice(list(self.variables))
+        return self.variables[int(self.rng.random() * len(self.variables))]
+
+
+def serve_programs(requests: Queue, programs: Queue, weights: dict[str, float]) -> None:
+    generator = ProgramGenerator(weights=weights)
+
+    while (request := requests.get()) is not None:
+        programs.put(generator.generate_population(*request))
+
+
+# Generates programs in a process of its own, while the one that asked for
+# them does something else
+class GeneratorProcess:
+    def __init__(self, weights: dict[str, float] = {}) -> None:
+        self.requests: Queue = Queue()
+        self.programs: Queue = Queue()
+        self.process = Process(
+            target=serve_programs,
+            args=(self.requests, self.programs, weights),
+            daemon=True,
+        )
+        self.process.start()
+
+    def request(self, n: int, seed: int) -> None:
+        self.requests.put((n, seed))
+
+    def get(self) -> list[str]:
+        return self.programs.get()
+
+    def close(self) -> None:
+        self.requests.put(None)
+        self.process.join()
 
 
 if __name__ == "__main__":
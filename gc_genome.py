@@ -0,0 +1,150 @@
+import re
+from typing import NamedTuple, Optional
+
+from gc_utils import split_command
+
+VARIABLE = re.compile("v[0-9]+")
+
+
+# One command, with variables as numbers and every other word as it is written.
+# Only tuples, so genomes can share lines and the garbage collector skips them.
+class Line(NamedTuple):
+    action: str
+    args: tuple
+    blocks: tuple[Optional["Line"], ...]
+    # Every use of a variable, nested commands included
+    variables: tuple[int, ...]
+    text: str
+
+    @classmethod
+    def create(
+        cls, action: str, args: tuple = (), blocks: tuple[Optional["Line"], ...] = ()
+    ) -> "Line":
+        variables = [arg for arg in args if type(arg) is int]
+
+        words = [action]
+        words.extend([f"v{arg}" if type(arg) is int else arg for arg in args])
+
+        if blocks:
+            texts = []
+
+            for block in blocks:
+                if block is None:
+                    texts.append("")
+                else:
+                    variables.extend(block.variables)
+                    texts.append(block.text)
+
+            words.append(f"( {' ; '.join(texts)} )")
+
+        return cls(action, args, blocks, tuple(variables), " ".join(words))
+
+    @classmethod
+    def parse(cls, words: list[str]) -> Optional["Line"]:
+        if not words:
+            return None
+
+        main, commands = split_command(words)
+
+        if not main:
+            return None
+
+        return cls.create(
+            main[0],
+            tuple(
+                int(word[1:]) if VARIABLE.fullmatch(word) else word for word in main[1:]
+            ),
+            tuple(cls.parse(command) for command in commands),
+        )
+
+
+# The lines of a program, and where each variable is first used, which is what
+# mutations need to know about the program
+class Genome:
+    def __init__(self, lines: list[Line] = []) -> None:
+        self.lines = list(lines)
+        self.uses: dict[int, int] = {}
+        self.first: dict[int, int] = {}
+
+        for index, line in enumerate(self.lines):
+            for variable in line.variables:
+                self.uses[variable] = self.uses.get(variable, 0) + 1
+                self.first.setdefault(variable, index)
+
+    @classmethod
+    def parse(cls, program: str) -> "Genome":
+        lines = [Line.parse(line.split()) for line in program.split("\n")]
+
+        return cls([line for line in lines if line is not None])
+
+    def copy(self) -> "Genome":
+        genome = Genome()
+        genome.lines = list(self.lines)
+        genome.uses = dict(self.uses)
+        genome.first = dict(self.first)
+
+        return genome
+
+    def render(self) -> str:
+        return "\n".join([line.text for line in self.lines])
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    # Variables used anywhere before the given line
+    def variables_before(self, index: int) -> set[int]:
+        return {variable for variable, first in self.first.items() if first < index}
+
+    def next_variable(self) -> int:
+        return max(self.uses, default=0) + 1
+
+    def insert(self, index: int, line: Line) -> None:
+        # Lines are usually added at the end while a genome is generated
+        if index < len(self.lines):
+            self.first = {
+                variable: first + 1 if first >= index else first
+                for variable, first in self.first.items()
+            }
+
+        self.lines.insert(index, line)
+
+        for variable in line.variables:
+            self.uses[variable] = self.uses.get(variable, 0) + 1
+
+            if self.first.get(variable, index + 1) > index:
+                self.first[variable] = index
+
+    def remove(self, index: int) -> Line:
+        line = self.lines.pop(index)
+
+        for variable in line.variables:
+            self.uses[variable] -= 1
+
+            if self.uses[variable] == 0:
+                del self.uses[variable]
+                del self.first[variable]
+
+        moved = {
+            variable for variable in line.variables if self.first.get(variable) == index
+        }
+
+        self.first = {
+            variable: first - 1 if first > index else first
+            for variable, first in self.first.items()
+        }
+
+        # Still used further down, which is now where it first appears
+        for variable in moved:
+            self.first[variable] = next(
+                i
+                for i in range(index, len(self.lines))
+                if variable in self.lines[i].variables
+            )
+
+        return line
+
+    def replace(self, index: int, line: Line) -> Line:
+        old_line = self.remove(index)
+        self.insert(index, line)
+
+        return old_line
@@ -1,15 +1,73 @@
-import time
-from typing import Optional
+from typing import NamedTuple, Optional
 
 
 class TooLargeException(Exception):
     pass
 
 
+class BudgetExceededException(Exception):
+    pass
+
+
+ARITHMETIC_ACTIONS = ["ADD", "SUB", "MUL", "DIV", "MOD", "POW"]
+
+# Actions that silently do nothing when one of their variables is undefined
+CHECKED_ACTIONS = ["COPY", "YIELD", "INPUT", "IF", "LOOP"]
+
+# Cost of executing each action once, LOOP also pays LOOP_ITERATION_COST per
+# iteration and arithmetic pays extra for integers wider than a machine word
+COSTS = {
+    "SET": 1,
+    "COPY": 1,
+    "YIELD": 1,
+    "INPUT": 1,
+    "ADD": 1,
+    "SUB": 1,
+    "MUL": 2,
+    "DIV": 2,
+    "MOD": 2,
+    "POW": 4,
+    "IF": 1,
+    "LOOP": 1,
+    "MULTI": 0,
+    "NOP": 0,
+}
+
+LOOP_ITERATION_COST = 1
+
+
+def size_cost(value) -> int:
+    return value.bit_length() >> 6 if type(value) is int else 0
+
+
+def pow_cost(base, exponent) -> int:
+    if type(base) is int and type(exponent) is int and exponent > 0:
+        return (exponent * base.bit_length()) >> 6
+
+    return 0
+
+
+class Command(NamedTuple):
+    action: str
+    arguments: tuple
+    blocks: tuple[tuple["Command", ...], ...]
+    cost: int = 0
+
+
+Block = tuple[Command, ...]
+
+
+# Variables are resolved to slots, arguments of compiled commands are slot
+# numbers (apart from the SET value and the IF operator)
+class Program(NamedTuple):
+    commands: Block
+    variables: tuple[str, ...]
+
+
 class Interpreter:
     def __init__(self, interactive: bool = True):
         self.interactive = interactive
-        self.variables = {}
+        self.registers = []
         self.inputs = []
         self.actions = {
             "SET": self.set_variable,
@@ -27,50 +85,184 @@ class Interpreter:
             "MULTI": self.multi,
             "NOP": self.nop,
         }
-        self.timeout = None
-        self.start_time = None
+        self.cost = 0
+        self.budget = None
+
+    def compile(self, code: str) -> Program:
+        commands = tuple(
+            self.parse_line(line.split()) for line in code.split("\n") if line.strip()
+        )
+
+        assigned = set()
+        self.collect_assigned(commands, assigned)
+
+        slots = {}
+        commands = self.resolve_block(commands, slots, assigned)
+
+        return Program(commands, tuple(slots))
+
+    def parse_line(self, words: list[str]) -> Command:
+        main, commands = self.split_command(words)
+
+        return Command(
+            main[0],
+            tuple(main[1:]),
+            tuple(
+                (self.parse_line(command),) if command else () for command in commands
+            ),
+        )
+
+    def is_well_formed(self, action: str, args: tuple, blocks: tuple) -> bool:
+        if action == "SET" or action == "COPY":
+            return len(args) == 2 and len(blocks) == 0
+        elif action == "YIELD" or action == "INPUT":
+            return len(args) == 1 and len(blocks) == 0
+        elif action in ARITHMETIC_ACTIONS:
+            return (len(args) == 2 or len(args) == 3) and len(blocks) == 0
+        elif action == "IF":
+            return len(args) == 3 and (len(blocks) == 1 or len(blocks) == 2)
+        elif action == "LOOP":
+            return len(args) == 2 and len(blocks) == 1
+        elif action == "MULTI":
+            return len(args) == 0 and len(blocks) == 2
+
+        return action == "NOP"
+
+    def collect_assigned(self, block: Block, assigned: set[str]):
+        for action, args, blocks, _ in block:
+            if action == "SET" and self.is_well_formed(action, args, blocks):
+                assigned.add(args[0])
+
+            for inner in blocks:
+                self.collect_assigned(inner, assigned)
+
+    def resolve_block(
+        self, block: Block, slots: dict[str, int], assigned: set[str]
+    ) -> Block:
+        resolved = []
+
+        for command in block:
+            command = self.resolve_command(command, slots, assigned)
+
+            if command is not None:
+                resolved.append(command)
+
+        return tuple(resolved)
+
+    def resolve_command(
+        self, command: Command, slots: dict[str, int], assigned: set[str]
+    ) -> Optional[Command]:
+        action, args, blocks, _ = command
+
+        if action not in COSTS:
+            return None
+
+        cost = COSTS[action]
+
+        if not self.is_well_formed(action, args, blocks):
+            return Command("NOP", (), (), cost) if cost else None
+
+        if action == "NOP":
+            return None
+
+        # Variables that are never SET can't be defined, so these are no-ops
+        variables = args[::2] if action == "IF" else args
+
+        if action in CHECKED_ACTIONS and any(var not in assigned for var in variables):
+            return Command("NOP", (), (), cost)
+
+        def slot(name: str) -> int:
+            return slots.setdefault(name, len(slots))
+
+        if action == "SET":
+            var_name, value = args
+
+            try:
+                value = int(value)
+            except ValueError:
+                pass
+
+            return Command(action, (slot(var_name), value), (), cost)
+
+        if action in ARITHMETIC_ACTIONS:
+            var1, var2, *rest = args
+            to = rest[0] if rest else var1
+
+            return Command(action, (slot(var1), slot(var2), slot(to)), (), cost)
+
+        if action == "IF":
+            left_var, operator, right_var = args
+            args = (slot(left_var), operator, slot(right_var))
+            blocks = blocks if len(blocks) == 2 else (blocks[0], ())
+        else:
+            args = tuple(slot(arg) for arg in args)
+
+        return Command(
+            action,
+            args,
+            tuple(self.resolve_block(inner, slots, assigned) for inner in blocks),
+            cost,
+        )
 
     def run(
         self,
         code: str,
         inputs: list[int] = [],
-        recurse: bool = False,
-        timeout: Optional[int] = None,
+        budget: Optional[int] = None,
     ):
-        lines = code.split("\n")
+        return self.execute(self.compile(code), inputs, budget)
 
-        self.inputs = inputs.copy()
+    def execute(
+        self,
+        program: Program,
+        inputs: list[int] = [],
+        budget: Optional[int] = None,
+    ):
+        slots = len(program.variables)
 
-        if timeout:
-            self.timeout = timeout
-            self.start_time = time.time()
+        if len(self.registers) < slots:
+            self.registers.extend([None] * (slots - len(self.registers)))
 
-        if self.timeout and time.time() - self.start_time > self.timeout:
-            raise TimeoutError("Timeout exceeded")
+        self.inputs = list(inputs)
+        self.cost = 0
+        self.budget = budget
 
-        result = []
+        try:
+            return self.execute_block(program.commands)
+        finally:
+            self.registers[:slots] = [None] * slots
+            self.budget = None
+
+    def measure(
+        self,
+        program: Program,
+        inputs: list[int] = [],
+        budget: Optional[int] = None,
+    ) -> tuple[list[int], int]:
+        result = self.execute(program, inputs, budget)
+
+        return result, self.cost
 
-        for line in lines:
-            if line.strip():
-                main, commands = self.split_command(line.split())
-                action, arguments = main[0], main[1:]
+    def execute_block(self, block: Block):
+        result = []
 
-                if action in self.actions:
-                    action_res = self.actions[action](
-                        arguments,
-                        commands,
-                    )
+        for action, arguments, blocks, cost in block:
+            if cost:
+                self.charge(cost)
 
-                    if action_res is not None:
-                        result.extend(action_res)
+            action_res = self.actions[action](arguments, blocks)
 
-        if not recurse:
-            self.variables = {}
-            self.timeout = None
-            self.start_time = None
+            if action_res is not None:
+                result.extend(action_res)
 
         return result
 
+    def charge(self, cost: int):
+        self.cost += cost
+
+        if self.budget is not None and self.cost > self.budget:
+            raise BudgetExceededException()
+
     def split_command(self, command):
         nest_level = 0
         action_no = 0
@@ -107,187 +299,153 @@ class Interpreter:
 
         return main, commands
 
-    def check_variables(self, *variables: str, threshold=10**15):
+    def check_variables(self, *variables: int, threshold=10**15):
         for variable in variables:
-            if self.variables[variable] > threshold:
+            value = self.registers[variable]
+
+            if value is None:
+                raise KeyError(variable)
+
+            if value > threshold:
                 return False
 
         return True
 
-    def set_variable(self, args, commands):
-        if len(args) != 2 or len(commands) != 0:
-            return
-
+    def set_variable(self, args, blocks):
         var_name, value = args
 
-        self.variables[var_name] = int(value)
-
-    def copy_variable(self, args, commands):
-        if len(args) != 2 or len(commands) != 0:
-            return
+        self.registers[var_name] = int(value)
 
+    def copy_variable(self, args, blocks):
         to_var, from_var = args
 
-        if to_var not in self.variables or from_var not in self.variables:
+        if self.registers[to_var] is None or self.registers[from_var] is None:
             return
 
-        self.variables[to_var] = self.variables[from_var]
-
-    def yield_variable(self, args, commands):
-        if len(args) != 1 or len(commands) != 0:
-            return
+        self.registers[to_var] = self.registers[from_var]
 
+    def yield_variable(self, args, blocks):
         (var_name,) = args
 
-        if var_name in self.variables:
+        if self.registers[var_name] is not None:
             if self.interactive:
-                print(self.variables[var_name])
+                print(self.registers[var_name])
             else:
-                return [self.variables[var_name]]
-
-    def input_number(self, args, commands):
-        if len(args) != 1 or len(commands) != 0:
-            return
+                return [self.registers[var_name]]
 
+    def input_number(self, args, blocks):
         (var_name,) = args
 
-        if var_name in self.variables:
+        if self.registers[var_name] is not None:
             if self.interactive:
                 i = input()
                 if i.isnumeric():
-                    self.variables[var_name] = int(i)
+                    self.registers[var_name] = int(i)
             else:
                 if len(self.inputs) > 0:
-                    self.variables[var_name] = self.inputs.pop()
-
-    def add_variables(self, args, commands):
-        if (len(args) != 2 and len(args) != 3) or len(commands) != 0:
-            return
+                    self.registers[var_name] = self.inputs.pop()
 
-        var1, var2, *rest = args
+    def add_variables(self, args, blocks):
+        var1, var2, to = args
 
         if not self.check_variables(var1, var2):
             raise TooLargeException()
 
-        to = var1
-
-        if len(args) == 3:
-            to = rest[0]
+        if self.registers[to] is not None:
+            left = self.registers[var1]
+            right = self.registers[var2]
 
-        if var1 in self.variables and var2 in self.variables and to in self.variables:
-            result = self.variables[var1] + self.variables[var2]
-            self.variables[to] = result
+            self.charge(size_cost(left) + size_cost(right))
 
-    def subtract_variables(self, args, commands):
-        if (len(args) != 2 and len(args) != 3) or len(commands) != 0:
-            return
+            self.registers[to] = left + right
 
-        var1, var2, *rest = args
+    def subtract_variables(self, args, blocks):
+        var1, var2, to = args
 
         if not self.check_variables(var1, var2):
             raise TooLargeException()
 
-        to = var1
+        if self.registers[to] is not None:
+            left = self.registers[var1]
+            right = self.registers[var2]
 
-        if len(args) == 3:
-            to = rest[0]
+            self.charge(size_cost(left) + size_cost(right))
 
-        if var1 in self.variables and var2 in self.variables and to in self.variables:
-            result = self.variables[var1] - self.variables[var2]
-            self.variables[to] = result
+            self.registers[to] = left - right
 
-    def multiply_variables(self, args, commands):
-        if (len(args) != 2 and len(args) != 3) or len(commands) != 0:
-            return
-
-        var1, var2, *rest = args
+    def multiply_variables(self, args, blocks):
+        var1, var2, to = args
 
         if not self.check_variables(var1, var2, threshold=10**10):
             raise TooLargeException()
 
-        to = var1
+        if self.registers[to] is not None:
+            left = self.registers[var1]
+            right = self.registers[var2]
 
-        if len(args) == 3:
-            to = rest[0]
+            self.charge(size_cost(left) + size_cost(right))
 
-        if var1 in self.variables and var2 in self.variables and to in self.variables:
-            result = self.variables[var1] * self.variables[var2]
-            self.variables[to] = result
+            self.registers[to] = left * right
 
-    def divide_variables(self, args, commands):
-        if (len(args) != 2 and len(args) != 3) or len(commands) != 0:
-            return
-
-        var1, var2, *rest = args
+    def divide_variables(self, args, blocks):
+        var1, var2, to = args
 
         if not self.check_variables(var1, var2, threshold=10**10):
             raise TooLargeException()
 
-        to = var1
-
-        if len(args) == 3:
-            to = rest[0]
+        if self.registers[to] is not None:
+            left = self.registers[var1]
+            right = self.registers[var2]
 
-        if var1 in self.variables and var2 in self.variables and to in self.variables:
-            result = self.variables[var1] // self.variables[var2]
-            self.variables[to] = result
+            self.charge(size_cost(left) + size_cost(right))
 
-    def mod_variables(self, args, commands):
-        if (len(args) != 2 and len(args) != 3) or len(commands) != 0:
-            return
+            self.registers[to] = left // right
 
-        var1, var2, *rest = args
+    def mod_variables(self, args, blocks):
+        var1, var2, to = args
 
         if not self.check_variables(var1, var2, threshold=10**10):
             raise TooLargeException()
 
-        to = var1
-
-        if len(args) == 3:
-            to = rest[0]
+        if self.registers[to] is not None:
+            left = self.registers[var1]
+            right = self.registers[var2]
 
-        if var1 in self.variables and var2 in self.variables and to in self.variables:
-            result = self.variables[var1] % self.variables[var2]
-            self.variables[to] = result
+            self.charge(size_cost(left) + size_cost(right))
 
-    def pow_variables(self, args, commands):
-        if (len(args) != 2 and len(args) != 3) or len(commands) != 0:
-            return
+            self.registers[to] = left % right
 
-        var1, var2, *rest = args
+    def pow_variables(self, args, blocks):
+        var1, var2, to = args
 
         if (
             not self.check_variables(var1, var2, threshold=10**8)
-            or self.variables[var2] > 100
+            or self.registers[var2] > 100
         ):
             raise TooLargeException()
 
-        to = var1
+        if self.registers[to] is not None:
+            left = self.registers[var1]
+            right = self.registers[var2]
 
-        if len(args) == 3:
-            to = rest[0]
+            self.charge(pow_cost(left, right))
 
-        if var1 in self.variables and var2 in self.variables and to in self.variables:
-            result = self.variables[var1] ** self.variables[var2]
-            self.variables[to] = result
+            self.registers[to] = left**right
 
     def if_comp(
         self,
         args,
-        commands,
+        blocks,
     ):
-        if len(args) != 3 or (len(commands) != 2 and len(commands) != 1):
-            return
-
         left_var, operator, right_var = args
 
         if_result = False
 
-        if not left_var in self.variables or not right_var in self.variables:
+        if self.registers[left_var] is None or self.registers[right_var] is None:
             return
 
-        left = self.variables[left_var]
-        right = self.variables[right_var]
+        left = self.registers[left_var]
+        right = self.registers[right_var]
 
         if operator == ">" and left > right:
             if_result = True
@@ -303,51 +461,49 @@ class Interpreter:
             if_result = True
 
         if if_result:
-            result = self.run(" ".join(commands[0]), self.inputs, True)
+            result = self.execute_block(blocks[0])
 
             if not self.interactive:
                 return result
-        elif len(commands) == 2:
-            result = self.run(" ".join(commands[1]), self.inputs, True)
+        elif blocks[1]:
+            result = self.execute_block(blocks[1])
 
             if not self.interactive:
                 return result
 
-    def loop(self, args, commands):
-        if len(args) != 2 or len(commands) != 1:
-            return
-
+    def loop(self, args, blocks):
         count_var, index_var = args
 
         results = []
 
-        if count_var in self.variables and index_var in self.variables:
+        if (
+            self.registers[count_var] is not None
+            and self.registers[index_var] is not None
+        ):
             if not self.check_variables(count_var, threshold=10**5):
                 raise TooLargeException()
 
-            index_before = self.variables[index_var]
+            index_before = self.registers[index_var]
 
-            for i in range(self.variables[count_var]):
-                self.variables[index_var] = i + 1
-                results.extend(self.run(" ".join(commands[0]), self.inputs, True))
+            for i in range(self.registers[count_var]):
+                self.registers[index_var] = i + 1
+                self.charge(LOOP_ITERATION_COST)
+                results.extend(self.execute_block(blocks[0]))
 
-            self.variables[index_var] = index_before
+            self.registers[index_var] = index_before
 
         if not self.interactive:
             return results
 
-    def multi(self, args, commands):
-        if len(args) != 0 or len(commands) != 2:
-            return
-
+    def multi(self, args, blocks):
         results = []
 
-        results.extend(self.run(" ".join(commands[0]), self.inputs, True))
-        results.extend(self.run(" ".join(commands[1]), self.inputs, True))
+        results.extend(self.execute_block(blocks[0]))
+        results.extend(self.execute_block(blocks[1]))
 
         return results
 
-    def nop(self, args, commands):
+    def nop(self, args, blocks):
         pass
 
 
@@ -357,4 +513,4 @@ if __name__ == "__main__":
     interpreter = Interpreter()
 
     with open(sys.argv[1], "r") as f:
-        print(interpreter.run(f.read()))
+        print(interpreter.execute(interpreter.compile(f.read())))
@@ -0,0 +1,294 @@
+import argparse
+import json
+import math
+import os
+import socket
+from multiprocessing import Process, Queue
+from queue import Empty
+from typing import Optional
+
+from gc_archive import HallOfFame
+from gc_cache import FitnessCache
+from gc_evolution import (
+    NEW_RANDOM,
+    Individual,
+    create_population,
+    deduplicate,
+    evaluate_population,
+    mutate,
+    reproduce,
+)
+from gc_interpreter import Interpreter
+from gc_utils import RNG, Runner, available_cpus, seed_rng
+
+# Magic values
+MIGRATION_INTERVAL = 10  # Generations between migrations
+MIGRANTS = 5  # Top programs sent to each neighbour
+
+POPULATION_SIZE = 10000
+
+# Seconds to wait on a neighbour before giving up on that migration
+SOCKET_TIMEOUT = 2
+
+
+def ring_topology(island: int, count: int) -> list[int]:
+    return [(island + 1) % count]
+
+
+def random_topology(island: int, count: int) -> list[int]:
+    return [RNG.choice([i for i in range(count) if i != island])]
+
+
+TOPOLOGIES = {"ring": ring_topology, "random": random_topology}
+
+
+class QueueMigration:
+    def __init__(self, inboxes: list[Queue], island: int) -> None:
+        self.inboxes = inboxes
+        self.island = island
+
+    def start(self) -> None:
+        pass
+
+    def send(self, target: int, programs: list[str]) -> None:
+        self.inboxes[target].put(programs)
+
+    def receive(self) -> list[str]:
+        programs = []
+
+        while True:
+            try:
+                programs.extend(self.inboxes[self.island].get(block=False))
+            except Empty:
+                return programs
+
+    def stop(self) -> None:
+        pass
+
+
+# One JSON list of programs per connection, migrants that can't be delivered
+# are dropped so an island never waits on its neighbours
+class TcpMigration:
+    def __init__(self, addresses: list[tuple[str, int]], island: int) -> None:
+        self.addresses = addresses
+        self.island = island
+        self.listener: Optional[socket.socket] = None
+
+    def start(self) -> None:
+        self.listener = socket.create_server(self.addresses[self.island])
+        self.listener.setblocking(False)
+
+    def send(self, target: int, programs: list[str]) -> None:
+        try:
+            with socket.create_connection(
+                self.addresses[target], timeout=SOCKET_TIMEOUT
+            ) as connection:
+                connection.sendall(json.dumps(programs).encode())
+        except OSError:
+            pass
+
+    def receive(self) -> list[str]:
+        programs = []
+
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except BlockingIOError:
+                return programs
+
+            with connection:
+                connection.settimeout(SOCKET_TIMEOUT)
+
+                try:
+                    data = b""
+
+                    while chunk := connection.recv(65536):
+                        data += chunk
+
+                    programs.extend(
+                        program
+                        for program in json.loads(data)
+                        if isinstance(program, str)
+                    )
+                except (OSError, ValueError):
+                    continue
+
+    def stop(self) -> None:
+        self.listener.close()
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+
+    return host, int(port)
+
+
+def run_island(
+    island: int,
+    count: int,
+    tests: list[tuple[list[int], list[int]]],
+    migration,
+    topology: str = "ring",
+    generations: Optional[int] = None,
+    population_size: int = POPULATION_SIZE,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> None:
+    # Forked islands would otherwise all evolve the same programs
+    seed_rng(seed, island)
+
+    migration.start()
+
+    interpreter = Interpreter(False)
+
+    runner = Runner(interpreter)
+
+    runner.create_workers(workers)
+
+    cache = FitnessCache()
+
+    hall_of_fame = HallOfFame(f"outputs/hall_of_fame_i{island}.gca")
+
+    population = create_population(population_size)
+
+    generation = 0
+
+    while generations is None or generation < generations:
+        population, fitness_scores = evaluate_population(
+            population, runner, tests, cache
+        )
+
+        print(
+            f"Island {island}, best of generation {generation}:",
+            fitness_scores[0],
+            fitness_scores[1],
+            fitness_scores[2],
+        )
+
+        hall_of_fame.consider(generation, population[0])
+
+        if count > 1 and generation % MIGRATION_INTERVAL == MIGRATION_INTERVAL - 1:
+            for target in TOPOLOGIES[topology](island, count):
+                migration.send(
+                    target, [individual.program for individual in population[:MIGRANTS]]
+                )
+
+        population = reproduce(deduplicate(population), mutate, None, len(population))
+
+        # Migrants take the place of the new random programs at the end
+        migrants = migration.receive()[: math.ceil(len(population) * NEW_RANDOM)]
+
+        if len(migrants) > 0:
+            population[-len(migrants) :] = [
+                Individual(None, text=program) for program in migrants
+            ]
+
+        generation += 1
+
+    runner.kill_workers()
+    migration.stop()
+    hall_of_fame.close()
+
+
+def start_islands(
+    tests: list[tuple[list[int], list[int]]],
+    count: int,
+    topology: str = "ring",
+    addresses: Optional[list[tuple[str, int]]] = None,
+    islands: Optional[list[int]] = None,
+    generations: Optional[int] = None,
+    population_size: int = POPULATION_SIZE,
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> list[Process]:
+    if topology not in TOPOLOGIES:
+        raise ValueError(f"Unknown topology: {topology}")
+
+    if islands is None:
+        islands = list(range(count))
+
+    if workers is None:
+        workers = max(available_cpus() // len(islands), 1)
+
+    # Without addresses all islands have to run here, talking over queues
+    if addresses is None:
+        inboxes = [Queue() for _ in range(count)]
+    elif len(addresses) != count:
+        raise ValueError("Every island needs an address")
+
+    processes = []
+
+    for island in islands:
+        if addresses is None:
+            migration = QueueMigration(inboxes, island)
+        else:
+            migration = TcpMigration(addresses, island)
+
+        processes.append(
+            Process(
+                target=run_island,
+                args=(
+                    island,
+                    count,
+                    tests,
+                    migration,
+                    topology,
+                    generations,
+                    population_size,
+                    workers,
+                    seed,
+                ),
+            )
+        )
+
+    for process in processes:
+        process.start()
+
+    return processes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evolve several populations")
+    parser.add_argument("--islands", type=int, default=4)
+    parser.add_argument("--topology", choices=list(TOPOLOGIES), default="ring")
+    parser.add_argument(
+        "--addresses",
+        help="host:port of every island, comma separated, to migrate over TCP",
+    )
+    parser.add_argument(
+        "--run", help="Islands to run on this machine, comma separated (all)"
+    )
+    parser.add_argument("--generations", type=int)
+    parser.add_argument("--population", type=int, default=POPULATION_SIZE)
+    parser.add_argument(
+        "--seed", type=int, help="Seed of the run, each island gets its own stream"
+    )
+    args = parser.parse_args()
+
+    from gc_tests import tests
+
+    if not os.path.exists("outputs"):
+        os.mkdir("outputs")
+
+    addresses = None
+    islands = None
+
+    if args.addresses:
+        addresses = [parse_address(address) for address in args.addresses.split(",")]
+
+    if args.run:
+        islands = [int(island) for island in args.run.split(",")]
+
+    processes = start_islands(
+        tests,
+        args.islands,
+        args.topology,
+        addresses=addresses,
+        islands=islands,
+        generations=args.generations,
+        population_size=args.population,
+        seed=args.seed,
+    )
+
+    for process in processes:
+        process.join()
@@ -0,0 +1,393 @@
+import operator
+from typing import Optional
+
+from gc_interpreter import (
+    ARITHMETIC_ACTIONS,
+    Block,
+    Command,
+    Program,
+    pow_cost,
+    size_cost,
+)
+
+# What is known about a slot at some point of the program, slots missing
+# from a state could be anything
+UNDEFINED = "undefined"
+DEFINED = "defined"
+
+OPERATIONS = {
+    "ADD": (operator.add, 10**15),
+    "SUB": (operator.sub, 10**15),
+    "MUL": (operator.mul, 10**10),
+    "DIV": (operator.floordiv, 10**10),
+    "MOD": (operator.mod, 10**10),
+    "POW": (operator.pow, 10**8),
+}
+
+COMPARISONS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "=": operator.eq,
+    "<=": operator.le,
+    "<": operator.lt,
+    "!=": operator.ne,
+}
+
+
+def cost_only(cost: int) -> list[Command]:
+    return [Command("NOP", (), (), cost)] if cost else []
+
+
+# Removed commands leave a cost-only NOP behind, which is then merged into the
+# following command, so outputs, exceptions and costs stay exactly the same
+class Optimizer:
+    def optimize(self, program: Program) -> Program:
+        state = {slot: UNDEFINED for slot in range(len(program.variables))}
+
+        commands = []
+        self.fold_block(program.commands, state, commands)
+
+        commands, _ = self.eliminate_block(tuple(commands), set())
+
+        return Program(self.merge_costs(commands), program.variables)
+
+    def is_defined(self, state: dict, slot: int) -> bool:
+        return slot in state and state[slot] != UNDEFINED
+
+    def is_undefined(self, state: dict, slot: int) -> bool:
+        return state.get(slot) == UNDEFINED
+
+    def value(self, state: dict, slot: int) -> Optional[int]:
+        value = state.get(slot)
+
+        return value if type(value) is int else None
+
+    def forget(self, state: dict, slot: int):
+        if self.is_defined(state, slot):
+            state[slot] = DEFINED
+        else:
+            state.pop(slot, None)
+
+    def merge_states(self, state: dict, candidates: list[dict]):
+        state.clear()
+
+        for slot in set.intersection(*[set(candidate) for candidate in candidates]):
+            values = [candidate[slot] for candidate in candidates]
+
+            if all(value == values[0] for value in values):
+                state[slot] = values[0]
+            elif all(value != UNDEFINED for value in values):
+                state[slot] = DEFINED
+
+    def written(self, block: Block, slots: set[int]) -> set[int]:
+        for action, args, blocks, _ in block:
+            if action in ["SET", "COPY", "INPUT"]:
+                slots.add(args[0])
+            elif action in ARITHMETIC_ACTIONS:
+                slots.add(args[2])
+            elif action == "LOOP":
+                slots.add(args[1])
+
+            for inner in blocks:
+                self.written(inner, slots)
+
+        return slots
+
+    # Returns True when the rest of the block can never run
+    def fold_block(self, block: Block, state: dict, result: list[Command]) -> bool:
+        for command in block:
+            if self.fold_command(command, state, result):
+                return True
+
+        return False
+
+    def fold_command(
+        self, command: Command, state: dict, result: list[Command]
+    ) -> bool:
+        action, args, blocks, cost = command
+
+        if action == "SET":
+            var_name, value = args
+
+            result.append(command)
+
+            if type(value) is not int:
+                return True
+
+            state[var_name] = value
+
+        elif action == "COPY":
+            to_var, from_var = args
+
+            if self.is_undefined(state, to_var) or self.is_undefined(state, from_var):
+                result.extend(cost_only(cost))
+            elif self.is_defined(state, to_var) and self.is_defined(state, from_var):
+                value = self.value(state, from_var)
+
+                if value is not None:
+                    result.append(Command("SET", (to_var, value), (), cost))
+                else:
+                    result.append(command)
+
+                state[to_var] = state[from_var]
+            else:
+                result.append(command)
+                self.forget(state, to_var)
+
+        elif action == "YIELD" or action == "INPUT":
+            (var_name,) = args
+
+            if self.is_undefined(state, var_name):
+                result.extend(cost_only(cost))
+            else:
+                result.append(command)
+
+                if action == "INPUT":
+                    self.forget(state, var_name)
+
+        elif action in OPERATIONS:
+            return self.fold_arithmetic(command, state, result)
+
+        elif action == "IF":
+            return self.fold_if(command, state, result)
+
+        elif action == "LOOP":
+            return self.fold_loop(command, state, result)
+
+        elif action == "MULTI":
+            # Running the blocks one after another is exactly what MULTI does
+            result.extend(cost_only(cost))
+
+            return self.fold_block(blocks[0], state, result) or self.fold_block(
+                blocks[1], state, result
+            )
+
+        else:
+            result.append(command)
+
+        return False
+
+    def fold_arithmetic(
+        self, command: Command, state: dict, result: list[Command]
+    ) -> bool:
+        action, (var1, var2, to), _, cost = command
+        operation, threshold = OPERATIONS[action]
+
+        left = self.value(state, var1)
+        right = self.value(state, var2)
+
+        result_command = command
+
+        if (
+            self.is_undefined(state, var1)
+            or self.is_undefined(state, var2)
+            or (left is not None and left > threshold)
+            or (right is not None and right > threshold)
+            or (action == "POW" and right is not None and right > 100)
+        ):
+            # Raises KeyError or TooLargeException whichever way it goes
+            result.append(command)
+            return True
+
+        if left is not None and right is not None:
+            if self.is_undefined(state, to):
+                result_command = None
+            elif self.is_defined(state, to):
+                try:
+                    value = operation(left, right)
+                except ZeroDivisionError:
+                    result.append(command)
+                    return True
+
+                if type(value) is int:
+                    extra = (
+                        pow_cost(left, right)
+                        if action == "POW"
+                        else size_cost(left) + size_cost(right)
+                    )
+                    result_command = Command("SET", (to, value), (), cost + extra)
+
+        if result_command is None:
+            result.extend(cost_only(cost))
+        else:
+            result.append(result_command)
+
+        if result_command is not None and result_command.action == "SET":
+            state[to] = result_command.arguments[1]
+        elif not self.is_undefined(state, to):
+            self.forget(state, to)
+
+        state.setdefault(var1, DEFINED)
+        state.setdefault(var2, DEFINED)
+
+        return False
+
+    def fold_if(self, command: Command, state: dict, result: list[Command]) -> bool:
+        _, (left_var, comparison, right_var), blocks, cost = command
+
+        if self.is_undefined(state, left_var) or self.is_undefined(state, right_var):
+            result.extend(cost_only(cost))
+            return False
+
+        left = self.value(state, left_var)
+        right = self.value(state, right_var)
+
+        if left is not None and right is not None:
+            if_result = comparison in COMPARISONS and COMPARISONS[comparison](
+                left, right
+            )
+
+            result.extend(cost_only(cost))
+
+            return self.fold_block(blocks[0] if if_result else blocks[1], state, result)
+
+        candidates = []
+        folded = []
+
+        for block in blocks:
+            block_state = dict(state)
+            block_result = []
+
+            if not self.fold_block(block, block_state, block_result):
+                candidates.append(block_state)
+
+            folded.append(tuple(block_result))
+
+        if not (self.is_defined(state, left_var) and self.is_defined(state, right_var)):
+            candidates.append(dict(state))
+
+        result.append(command._replace(blocks=tuple(folded)))
+
+        if not candidates:
+            return True
+
+        self.merge_states(state, candidates)
+
+        return False
+
+    def fold_loop(self, command: Command, state: dict, result: list[Command]) -> bool:
+        _, (count_var, index_var), blocks, cost = command
+
+        if self.is_undefined(state, count_var) or self.is_undefined(state, index_var):
+            result.extend(cost_only(cost))
+            return False
+
+        count = self.value(state, count_var)
+        entered = self.is_defined(state, index_var)
+
+        if entered and count is not None and count > 10**5:
+            result.append(command)
+            return True
+
+        if entered and count is not None and count <= 0:
+            result.extend(cost_only(cost))
+            return False
+
+        index_before = state.get(index_var)
+        written = self.written(blocks[0], set())
+
+        for slot in written:
+            self.forget(state, slot)
+
+        body_state = dict(state)
+        body_state[index_var] = DEFINED
+        body = []
+
+        self.fold_block(blocks[0], body_state, body)
+
+        result.append(command._replace(blocks=(tuple(body),)))
+
+        if index_before is None:
+            state.pop(index_var, None)
+        else:
+            state[index_var] = index_before
+
+        return False
+
+    def eliminate_block(self, block: Block, live: set[int]) -> tuple[Block, set[int]]:
+        result = []
+
+        for command in reversed(block):
+            commands, live = self.eliminate_command(command, live)
+            result.extend(reversed(commands))
+
+        result.reverse()
+
+        return tuple(result), live
+
+    def eliminate_command(
+        self, command: Command, live: set[int]
+    ) -> tuple[list[Command], set[int]]:
+        action, args, blocks, cost = command
+
+        if action == "SET":
+            # A value that isn't a number raises when it runs, used or not
+            if args[0] not in live and type(args[1]) is int:
+                return cost_only(cost), live
+
+            return [command], live - {args[0]}
+
+        elif action == "COPY":
+            if args[0] not in live:
+                return cost_only(cost), live
+
+            return [command], live | {args[1]}
+
+        elif action == "YIELD" or action == "INPUT" or action in OPERATIONS:
+            return [command], live | set(args)
+
+        elif action == "IF":
+            left_var, _, right_var = args
+
+            then_block, then_live = self.eliminate_block(blocks[0], set(live))
+            else_block, else_live = self.eliminate_block(blocks[1], set(live))
+
+            if not then_block and not else_block:
+                return cost_only(cost), live
+
+            return [command._replace(blocks=(then_block, else_block))], (
+                live | then_live | else_live | {left_var, right_var}
+            )
+
+        elif action == "LOOP":
+            body_live = set(live)
+
+            while True:
+                body, body_in = self.eliminate_block(blocks[0], set(body_live))
+
+                if body_in <= body_live:
+                    break
+
+                body_live |= body_in
+
+            return [command._replace(blocks=(body,))], live | body_in | set(args)
+
+        elif action == "MULTI":
+            second, live = self.eliminate_block(blocks[1], live)
+            first, live = self.eliminate_block(blocks[0], live)
+
+            return [command._replace(blocks=(first, second))], live
+
+        return [command], live
+
+    def merge_costs(self, block: Block) -> Block:
+        result = []
+        pending = 0
+
+        for command in block:
+            if command.action == "NOP":
+                pending += command.cost
+                continue
+
+            result.append(
+                command._replace(
+                    blocks=tuple(self.merge_costs(inner) for inner in command.blocks),
+                    cost=command.cost + pending,
+                )
+            )
+            pending = 0
+
+        # Nothing follows, keep the cost where it was so it is still charged last
+        result.extend(cost_only(pending))
+
+        return tuple(result)
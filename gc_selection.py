@@ -0,0 +1,163 @@
+import heapq
+from typing import Sequence
+
+from gc_utils import RNG
+
+TOURNAMENT_SIZE = 4
+
+# Candidates of picks lexicase unpacks at once, which bounds its memory
+LEXICASE_CELLS = 2**22
+
+
+# Indices of the k best scores, best first, without sorting everything
+def top_k(scores: Sequence[int], k: int) -> list[int]:
+    return heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
+
+
+def tournament(scores: Sequence[int], k: int, size: int = TOURNAMENT_SIZE) -> list[int]:
+    return [
+        max(
+            [RNG.randrange(len(scores)) for _ in range(size)],
+            key=scores.__getitem__,
+        )
+        for _ in range(k)
+    ]
+
+
+def proportional(scores: Sequence[int], k: int) -> list[int]:
+    # Scores go negative, so weigh them by how far above the worst they are
+    lowest = min(scores)
+
+    return RNG.choices(
+        range(len(scores)), [score - lowest + 1 for score in scores], k=k
+    )
+
+
+def uniform(scores: Sequence[int], k: int) -> list[int]:
+    return RNG.sample(range(len(scores)), k)
+
+
+SELECTIONS = {
+    "uniform": uniform,
+    "tournament": tournament,
+    "proportional": proportional,
+}
+
+
+# Each pick walks the tests in a random order and keeps only the programs
+# with the lowest error on each, with epsilon anything within the median
+# absolute deviation of that test's errors counts as the lowest too. All the
+# picks walk their orders together, a test at a time, with their candidates as
+# bitsets over the distinct rows of errors.
+def lexicase(
+    errors: Sequence[Sequence[int]], k: int, epsilon: bool = False
+) -> list[int]:
+    # NumPy is only needed for this selection
+    import numpy as np
+
+    # Programs with the same errors are interchangeable, so only the distinct
+    # rows take part and a random program of the chosen row is picked
+    distinct: dict[tuple, int] = {}
+    inverse = np.array(
+        [distinct.setdefault(tuple(row), len(distinct)) for row in errors],
+        dtype=np.int64,
+    )
+    rows = np.array(list(distinct), dtype=np.float64)
+    count, tests = rows.shape
+    columns = np.ascontiguousarray(rows.T)
+
+    if epsilon:
+        matrix = rows[inverse]
+        tolerance = np.median(np.abs(matrix - np.median(matrix, axis=0)), axis=0)
+    else:
+        tolerance = np.zeros(tests)
+
+    # Rows with the lowest error of all on each test, and those close enough
+    # to it to be kept along with them
+    lowest = rows.min(axis=0)
+    best = pack_rows(columns == lowest[:, None])
+    within = pack_rows(columns <= (lowest + tolerance)[:, None])
+
+    generator = np.random.default_rng(RNG.getrandbits(64))
+    orders = generator.permuted(np.tile(np.arange(tests), (k, 1)), axis=1)
+    chosen = np.zeros(k, dtype=np.int64)
+
+    picks = np.arange(k)
+    candidates = np.tile(pack_rows(np.ones((1, count), dtype=bool)), (k, 1))
+
+    # Rows of candidates unpacked at once, which bounds the memory it takes
+    block = max(LEXICASE_CELLS // count, 1)
+
+    for step in range(tests):
+        order = orders[picks, step]
+
+        # Candidates that include one of the best rows keep just those, the
+        # rest have to look at the errors of all their candidates
+        known = (candidates & best[order]).any(axis=1)
+        candidates[known] &= within[order[known]]
+
+        unknown = np.flatnonzero(~known)
+
+        for first in range(0, len(unknown), block):
+            part = unknown[first : first + block]
+            mask = unpack_rows(candidates[part], count)
+            values = columns[order[part]]
+            least = np.where(mask, values, np.inf).min(axis=1)
+            mask &= values <= (least + tolerance[order[part]])[:, None]
+            candidates[part] = pack_rows(mask)
+
+        # Picks down to their last candidate are done, which is when a single
+        # word is left and it has a single bit
+        single = ((candidates != 0).sum(axis=1) == 1) & (
+            (candidates & (candidates - np.uint64(1))) == 0
+        ).all(axis=1)
+        done = candidates[single]
+        word = (done != 0).argmax(axis=1)
+        bit = np.log2(done[np.arange(len(done)), word].astype(np.float64))
+        chosen[picks[single]] = 64 * word + bit.astype(np.int64)
+
+        picks = picks[~single]
+        candidates = candidates[~single]
+
+        if len(picks) == 0:
+            break
+
+    # The rest tied on every test, any of their candidates will do
+    for first in range(0, len(picks), block):
+        mask = unpack_rows(candidates[first : first + block], count)
+        nth = (generator.random(len(mask)) * mask.sum(axis=1)).astype(np.int64)
+        chosen[picks[first : first + block]] = (
+            np.cumsum(mask, axis=1) > nth[:, None]
+        ).argmax(axis=1)
+
+    sizes = np.bincount(inverse)
+    members = np.argsort(inverse, kind="stable")
+    offsets = (generator.random(k) * sizes[chosen]).astype(np.int64)
+
+    return members[np.cumsum(sizes)[chosen] - sizes[chosen] + offsets].tolist()
+
+
+# Each row of a boolean matrix as a bitset, 64 columns to a word
+def pack_rows(mask):
+    import numpy as np
+
+    words = -(-mask.shape[1] // 64)
+    bits = np.zeros((mask.shape[0], 8 * words), dtype=np.uint8)
+    bits[:, : -(-mask.shape[1] // 8)] = np.packbits(mask, axis=1, bitorder="little")
+
+    return bits.view("<u8")
+
+
+def unpack_rows(bits, count: int):
+    import numpy as np
+
+    return np.unpackbits(
+        bits.view(np.uint8), axis=1, count=count, bitorder="little"
+    ).view(bool)
+
+
+def epsilon_lexicase(errors: Sequence[Sequence[int]], k: int) -> list[int]:
+    return lexicase(errors, k, epsilon=True)
+
+
+LEXICASE_SELECTIONS = {"lexicase": lexicase, "epsilon_lexicase": epsilon_lexicase}
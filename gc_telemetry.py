@@ -0,0 +1,114 @@
+import json
+import time
+from contextlib import nullcontext
+from typing import Callable, Optional
+
+# What the workers count, in the order of their status array after the
+# task id and position: nanoseconds spent working, programs run, then runs
+# that raised TooLargeException, went over budget, hit the CPU limit or failed
+# in any other way
+WORKER_COUNTERS = [
+    "busy_ns",
+    "programs_run",
+    "too_large",
+    "over_budget",
+    "timed_out",
+    "other_errors",
+]
+
+# Shared by every stage while telemetry is off, so timing costs nothing then
+NO_STAGE = nullcontext()
+
+
+class Stage:
+    def __init__(self, telemetry: "Telemetry", name: str) -> None:
+        self.telemetry = telemetry
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *_) -> None:
+        stages = self.telemetry.stages
+        stages[self.name] = (
+            stages.get(self.name, 0.0) + time.perf_counter() - self.started
+        )
+
+
+# Collects stage timings during a generation, and emits them along with the
+# worker counters and population statistics as one JSON object per generation
+class Telemetry:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        callback: Optional[Callable[[dict], None]] = None,
+    ) -> None:
+        self.enabled = path is not None or callback is not None
+        self.file = None if path is None else open(path, "a", buffering=1)
+        self.callback = callback
+        self.stages: dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.totals: Optional[list[int]] = None
+        self.failures = 0
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return NO_STAGE
+
+        return Stage(self, name)
+
+    def emit(self, generation: int, population: list, scores: list[int], runner):
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        elapsed = now - self.started
+
+        # Workers count from the start, only this generation's share is emitted
+        totals = runner.worker_totals()
+        before = self.totals or [0] * len(totals)
+        workers = dict(
+            zip(WORKER_COUNTERS, [after - then for after, then in zip(totals, before)])
+        )
+
+        compute = workers.pop("busy_ns") / 1e9
+        evaluation = self.stages.get("queue", 0.0) + self.stages.get("collect", 0.0)
+        lengths = [individual.program.count("\n") + 1 for individual in population]
+
+        record = {
+            "generation": generation,
+            "time": elapsed,
+            "stages": self.stages,
+            "worker_compute": compute,
+            # Share of the generation the workers spent running programs
+            "utilization": compute / (elapsed * max(len(runner.workers), 1)),
+            **workers,
+            "killed": len(runner.failures) - self.failures,
+            "programs_per_second": (
+                workers["programs_run"] / evaluation if evaluation > 0 else 0.0
+            ),
+            "population": {
+                "size": len(population),
+                "mean_length": sum(lengths) / max(len(lengths), 1),
+                "max_length": max(lengths, default=0),
+                "best_score": max(scores, default=None),
+                "mean_score": sum(scores) / max(len(scores), 1),
+            },
+        }
+
+        self.stages = {}
+        self.started = now
+        self.totals = totals
+        self.failures = len(runner.failures)
+
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+
+        if self.callback is not None:
+            self.callback(record)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
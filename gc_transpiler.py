@@ -0,0 +1,223 @@
+import functools
+from typing import Callable
+
+from gc_interpreter import (
+    LOOP_ITERATION_COST,
+    Block,
+    BudgetExceededException,
+    Command,
+    Interpreter,
+    Program,
+    TooLargeException,
+    pow_cost,
+    size_cost,
+)
+
+OPERATORS = {">": ">", ">=": ">=", "=": "==", "<=": "<=", "<": "<", "!=": "!="}
+
+ARITHMETIC = {
+    "ADD": ("+", 10**15),
+    "SUB": ("-", 10**15),
+    "MUL": ("*", 10**10),
+    "DIV": ("//", 10**10),
+    "MOD": ("%", 10**10),
+    "POW": ("**", 10**8),
+}
+
+
+# Variable slots become locals holding None until they are SET, so every
+# action keeps the Interpreter's "variable not defined" behaviour.
+class Transpiler:
+    def __init__(self, interpreter: Interpreter):
+        self.interpreter = interpreter
+        self.assigned = set()
+        self.lines = []
+        self.loops = 0
+
+    def build(self, program: Program) -> Callable[..., tuple[list[int], int]]:
+        try:
+            namespace = {
+                "TooLargeException": TooLargeException,
+                "BudgetExceededException": BudgetExceededException,
+                "_size_cost": size_cost,
+                "_pow_cost": pow_cost,
+            }
+            exec(compile(self.transpile(program), "<gc>", "exec"), namespace)
+
+            return namespace["_program"]
+        except (SyntaxError, RecursionError, MemoryError):
+            # Python refuses deeply nested code, the Interpreter doesn't care
+            return functools.partial(self.interpreter.measure, program)
+
+    def transpile(self, program: Program) -> str:
+        self.assigned = set()
+        self.lines = []
+        self.loops = 0
+
+        self.collect_assigned(program.commands)
+
+        self.emit(0, "def _program(inputs, budget=None):")
+        self.emit(1, "_result = []")
+        self.emit(1, "_inputs = list(inputs)")
+        self.emit(1, "_cost = 0")
+        self.emit(1, '_budget = float("inf") if budget is None else budget')
+
+        for slot in range(len(program.variables)):
+            self.emit(1, f"r{slot} = None")
+
+        self.emit_block(program.commands, 1, set())
+        self.emit(1, "return _result, _cost")
+
+        return "\n".join(self.lines)
+
+    def collect_assigned(self, block: Block):
+        for action, arguments, blocks, _ in block:
+            if action == "SET":
+                self.assigned.add(arguments[0])
+
+            for inner in blocks:
+                self.collect_assigned(inner)
+
+    def emit(self, indent: int, line: str):
+        self.lines.append("    " * indent + line)
+
+    def defined(self, slot: int, defined: set[int]) -> str:
+        if slot in defined:
+            return "True"
+
+        if slot not in self.assigned:
+            return "False"
+
+        return f"r{slot} is not None"
+
+    def emit_charge(self, cost: str, indent: int):
+        self.emit(indent, f"_cost += {cost}")
+        self.emit(indent, "if _cost > _budget:")
+        self.emit(indent + 1, "raise BudgetExceededException()")
+
+    def emit_block(self, block: Block, indent: int, defined: set[int]):
+        start = len(self.lines)
+
+        for command in block:
+            self.emit_command(command, indent, defined)
+
+        if len(self.lines) == start:
+            self.emit(indent, "pass")
+
+    def emit_check(self, slot: int, threshold: int, indent: int, defined: set[int]):
+        if slot not in defined:
+            if slot not in self.assigned:
+                self.emit(indent, f"raise KeyError({slot})")
+                return
+
+            self.emit(indent, f"if r{slot} is None:")
+            self.emit(indent + 1, f"raise KeyError({slot})")
+
+        self.emit(indent, f"if r{slot} > {threshold}:")
+        self.emit(indent + 1, "raise TooLargeException()")
+
+        defined.add(slot)
+
+    def emit_command(self, command: Command, indent: int, defined: set[int]):
+        action, args, blocks, cost = command
+
+        if cost:
+            self.emit_charge(str(cost), indent)
+
+        if action == "SET":
+            var_name, value = args
+
+            if type(value) is int:
+                self.emit(indent, f"r{var_name} = {value!r}")
+            else:
+                self.emit(indent, f"r{var_name} = int({value!r})")
+
+            defined.add(var_name)
+
+        elif action == "COPY":
+            to_var, from_var = args
+            condition = " and ".join(
+                [self.defined(to_var, defined), self.defined(from_var, defined)]
+            )
+
+            self.emit(indent, f"if {condition}:")
+            self.emit(indent + 1, f"r{to_var} = r{from_var}")
+
+        elif action == "YIELD":
+            (var_name,) = args
+
+            self.emit(indent, f"if {self.defined(var_name, defined)}:")
+            self.emit(indent + 1, f"_result.append(r{var_name})")
+
+        elif action == "INPUT":
+            (var_name,) = args
+
+            self.emit(indent, f"if {self.defined(var_name, defined)} and _inputs:")
+            self.emit(indent + 1, f"r{var_name} = _inputs.pop()")
+
+        elif action in ARITHMETIC:
+            operator, threshold = ARITHMETIC[action]
+            var1, var2, to = args
+
+            self.emit_check(var1, threshold, indent, defined)
+            if var1 not in defined:
+                return
+
+            self.emit_check(var2, threshold, indent, defined)
+            if var2 not in defined:
+                return
+
+            if action == "POW":
+                self.emit(indent, f"if r{var2} > 100:")
+                self.emit(indent + 1, "raise TooLargeException()")
+
+            self.emit(indent, f"if {self.defined(to, defined)}:")
+
+            if action == "POW":
+                self.emit_charge(f"_pow_cost(r{var1}, r{var2})", indent + 1)
+            else:
+                self.emit_charge(
+                    f"_size_cost(r{var1}) + _size_cost(r{var2})", indent + 1
+                )
+
+            self.emit(indent + 1, f"r{to} = r{var1} {operator} r{var2}")
+
+        elif action == "IF":
+            left_var, operator, right_var = args
+            condition = " and ".join(
+                [self.defined(left_var, defined), self.defined(right_var, defined)]
+            )
+            comparison = "False"
+
+            if operator in OPERATORS:
+                comparison = f"r{left_var} {OPERATORS[operator]} r{right_var}"
+
+            self.emit(indent, f"if {condition}:")
+            self.emit(indent + 1, f"if {comparison}:")
+            self.emit_block(blocks[0], indent + 2, defined.copy())
+
+            if blocks[1]:
+                self.emit(indent + 1, "else:")
+                self.emit_block(blocks[1], indent + 2, defined.copy())
+
+        elif action == "LOOP":
+            count_var, index_var = args
+            condition = " and ".join(
+                [self.defined(count_var, defined), self.defined(index_var, defined)]
+            )
+            loop = self.loops
+            self.loops += 1
+
+            self.emit(indent, f"if {condition}:")
+            self.emit(indent + 1, f"if r{count_var} > {10**5}:")
+            self.emit(indent + 2, "raise TooLargeException()")
+            self.emit(indent + 1, f"_before{loop} = r{index_var}")
+            self.emit(indent + 1, f"for _i{loop} in range(r{count_var}):")
+            self.emit(indent + 2, f"r{index_var} = _i{loop} + 1")
+            self.emit_charge(str(LOOP_ITERATION_COST), indent + 2)
+            self.emit_block(blocks[0], indent + 2, defined | {count_var, index_var})
+            self.emit(indent + 1, f"r{index_var} = _before{loop}")
+
+        elif action == "MULTI":
+            self.emit_block(blocks[0], indent, defined)
+            self.emit_block(blocks[1], indent, defined)
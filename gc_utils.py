@@ -1,13 +1,97 @@
+import functools
+import math
+import os
+import pickle
 import random
 import re
-from multiprocessing import Process, Queue
 import time
+from array import array
+from multiprocessing import Array, Process, Queue, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+from typing import Optional
 
-from gc_interpreter import Interpreter
+from gc_interpreter import BudgetExceededException, Interpreter, TooLargeException
+from gc_optimizer import Optimizer
+from gc_telemetry import WORKER_COUNTERS, Telemetry
+from gc_transpiler import Transpiler
 
+COMPILE_CACHE_SIZE = 16384
 
-def random_inverse_square():
-    random_value = random.random()
+# Cost a program may spend on a single test before it is aborted
+STEP_BUDGET = 100000
+
+# Seconds a worker may spend on one test of a program before it is killed and
+# restarted
+TASK_TIMEOUT = 10
+
+# Seconds between checks on the workers while waiting for results
+WATCHDOG_INTERVAL = 0.1
+
+# Status of a worker that is waiting for a task
+IDLE = -1
+
+# Where in its status array a worker shows which test of the program it runs,
+# after the task id, the position and the counters
+TEST_SLOT = 2 + len(WORKER_COUNTERS)
+
+# Programs sent to a worker in one batch
+CHUNK_SIZE = 64
+
+# Error of a test whose output is missing, the wrong length or way off
+ERROR_CAP = 10**12
+
+# Fingerprint of a program that never finished its tests, hash() never gives -1
+NO_FINGERPRINT = -1
+
+VARIABLE = re.compile("v[0-9]+")
+
+BACKENDS = ["interpreter", "transpiled", "vectorized"]
+
+# Every random choice of a run is drawn from here and nothing else, so seeding
+# it (and only it) repeats the run, whatever else uses the random module
+RNG = random.Random()
+
+
+# Islands draw from streams of their own, derived from the seed of the run
+def seed_rng(seed: Optional[int], stream: Optional[int] = None) -> None:
+    if seed is None:
+        RNG.seed()
+    elif stream is None:
+        RNG.seed(seed)
+    else:
+        RNG.seed(f"{seed}/{stream}")
+
+
+# CPUs this process may run on, limited by the affinity mask and any cgroup quota
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+
+    for quota_file, period_file in [
+        ("/sys/fs/cgroup/cpu.max", None),
+        ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us"),
+    ]:
+        try:
+            with open(quota_file) as f:
+                quota = f.read().split()
+
+            if period_file is not None:
+                with open(period_file) as f:
+                    quota += f.read().split()
+
+            if quota[0] not in ["max", "-1"]:
+                cpus = min(cpus, math.ceil(int(quota[0]) / int(quota[1])))
+        except (OSError, ValueError, IndexError):
+            continue
+
+    return max(cpus, 1)
+
+
+def random_inverse_square(rng: random.Random = RNG):
+    random_value = rng.random()
 
     inverse_square_number = 1 / (random_value**0.5)
 
@@ -18,6 +102,25 @@ def get_variables(program):
     return set(re.findall("v[0-9]+", program))
 
 
+# Same program up to whitespace and variable names, which never change behaviour
+def normalize_program(program: str) -> str:
+    names = {}
+    lines = []
+
+    for line in program.split("\n"):
+        words = [
+            (
+                names.setdefault(word, f"v{len(names)}")
+                if VARIABLE.fullmatch(word)
+                else word
+            )
+            for word in line.split()
+        ]
+        lines.append(" ".join(words))
+
+    return "\n".join(lines)
+
+
 def split_command(command: list[str]):
     nest_level = 0
     action_no = 0
@@ -78,65 +181,576 @@ class AlreadyExistsException(Exception):
     pass
 
 
-def work(interpreter: Interpreter, task_queue: Queue, output_queue: Queue) -> None:
-    while True:
-        code, inputs, program_id = task_queue.get(True)
-        start = time.time()
+# One generation in a single shared memory block: a header with the program
+# count, row width and size of the tests, the program offsets, one fixed-width
+# result row per program (fingerprint, passed test count, then their costs),
+# the encoded programs and the pickled tests. The tests are written once here
+# instead of being sent along with every batch.
+class SharedPopulation:
+    def __init__(self, memory: SharedMemory) -> None:
+        self.memory = memory
+        self.name = memory.name
+
+        self.count, self.width, tests_size = memory.buf[:24].cast("q")
+
+        offsets_end = 24 + 8 * (self.count + 1)
+        rows_end = offsets_end + 8 * self.count * self.width
+
+        self.offsets = memory.buf[24:offsets_end].cast("q")
+        self.rows = memory.buf[offsets_end:rows_end].cast("q")
+        self.data = memory.buf[rows_end:]
+
+        tests_start = self.offsets[self.count]
+        self.tests: list[tuple[list[int], list[int]]] = pickle.loads(
+            bytes(self.data[tests_start : tests_start + tests_size])
+        )
+
+    @classmethod
+    def create(
+        cls,
+        programs: list[str],
+        tests: list[tuple[list[int], list[int]]],
+        width: int,
+    ) -> "SharedPopulation":
+        encoded = [program.encode() for program in programs]
+        pickled = pickle.dumps(tests)
+
+        # One more for the fingerprint
+        width += 1
+        header = array("q", [len(programs), width, len(pickled), 0])
+
+        for code in encoded:
+            header.append(header[-1] + len(code))
+
+        start = 8 * len(header) + 8 * len(programs) * width
+        data = b"".join(encoded) + pickled
+
+        memory = SharedMemory(create=True, size=start + len(data) or 1)
+        memory.buf[: 8 * len(header)] = header.tobytes()
+        memory.buf[start : start + len(data)] = data
+
+        return cls(memory)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedPopulation":
+        return cls(SharedMemory(name=name))
+
+    def program(self, index: int) -> str:
+        return bytes(self.data[self.offsets[index] : self.offsets[index + 1]]).decode()
+
+    def set_result(
+        self, index: int, costs: list[int], fingerprint: int = NO_FINGERPRINT
+    ) -> None:
+        row = index * self.width
+
+        self.rows[row] = fingerprint
+        self.rows[row + 1] = len(costs)
+        self.rows[row + 2 : row + 2 + len(costs)] = array("q", costs)
+
+    def result(self, index: int) -> list[int]:
+        row = index * self.width
+
+        return self.rows[row + 2 : row + 2 + self.rows[row + 1]].tolist()
+
+    def fingerprint(self, index: int) -> int:
+        return self.rows[index * self.width]
+
+    def close(self) -> None:
+        self.offsets.release()
+        self.rows.release()
+        self.data.release()
+        self.memory.close()
+
+
+def test_error(output: Optional[list[int]], target: list[int]) -> int:
+    if output is None or len(output) != len(target):
+        return ERROR_CAP
+
+    error = sum(abs(value - expected) for value, expected in zip(output, target))
+
+    # Also catches the inf and nan a float output can give
+    if not error < ERROR_CAP:
+        return ERROR_CAP
+
+    return math.ceil(error)
+
+
+# Programs with the same fingerprint gave the same outputs on the tests they
+# ran, a missing output is -1, which no output hashes the same as
+def output_fingerprint(outputs: list[Optional[list[int]]]) -> int:
+    return hash(tuple(-1 if output is None else tuple(output) for output in outputs))
+
+
+# Errors of every test, then their costs (-1 where the program failed)
+def failed_errors(tests: list[tuple[list[int], list[int]]]) -> list[int]:
+    return [ERROR_CAP] * len(tests) + [-1] * len(tests)
+
+
+def limit_resources(memory_limit: Optional[int], cpu_limit: Optional[int]) -> None:
+    # Only available on Unix, so only imported when a limit is asked for
+    import resource
+    import signal
+
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    if cpu_limit is not None:
+        signal.signal(signal.SIGXCPU, raise_timeout)
+
+
+def raise_timeout(signum, frame):
+    raise TimeoutError()
+
+
+def reset_cpu_limit(cpu_limit: int) -> None:
+    import resource
+
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(time.process_time()) + cpu_limit
+
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def work(
+    interpreter: Interpreter,
+    task_queue: Queue,
+    output_queue: Queue,
+    status: Array,
+    backend: str = "interpreter",
+    budget: int = STEP_BUDGET,
+    optimize: bool = True,
+    memory_limit: Optional[int] = None,
+    cpu_limit: Optional[int] = None,
+) -> None:
+    transpiler = Transpiler(interpreter)
+    optimizer = Optimizer()
+
+    if memory_limit is not None or cpu_limit is not None:
+        limit_resources(memory_limit, cpu_limit)
+
+    if backend == "vectorized":
+        # NumPy is only needed for this backend
+        from gc_vectorized import VectorizedInterpreter
+
+        vectorized = VectorizedInterpreter(interpreter)
+
+    # Programs come back for every test and every generation, keep them loaded
+    @functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)
+    def load_program(code: str):
+        program = interpreter.compile(code)
+
+        if optimize:
+            program = optimizer.optimize(program)
+
+        if backend == "transpiled":
+            return transpiler.build(program)
+
+        if backend == "vectorized":
+            return functools.partial(vectorized.execute, program)
+
+        return functools.partial(interpreter.measure, program)
+
+    # Lets the Runner see which program is running, and for how long
+    def start(task_id: int, index: int):
+        # The index first, a new task is never shown with the old one
+        status[1] = index
+        status[0] = task_id
+
+        start_test(0)
+
+    # Every test run gets the whole timeout and CPU limit to itself, not the
+    # program on all its tests together
+    def start_test(test: int):
+        status[TEST_SLOT] = test
+
+        if cpu_limit is not None:
+            reset_cpu_limit(cpu_limit)
+
+    def run_test(code: str, inputs: list[int], test: int):
+        start_test(test)
+
+        return load_program(code)(inputs, budget)
+
+    # Failed runs by kind, for the telemetry
+    def count_error(error: BaseException):
+        if isinstance(error, TooLargeException):
+            status[4] += 1
+        elif isinstance(error, BudgetExceededException):
+            status[5] += 1
+        elif isinstance(error, TimeoutError):
+            status[6] += 1
+        else:
+            status[7] += 1
+
+    # Costs of the tests passed before the first failed one, and the
+    # fingerprint of the outputs up to it. They are run in the order given, as
+    # every test up to the first failed one counts towards the score, so no
+    # other order could stop a program any sooner.
+    def run_tests(
+        code: str, tests: list[tuple[list[int], list[int]]]
+    ) -> tuple[list[int], int]:
+        costs = []
+        outputs = []
+
+        try:
+            if backend == "vectorized":
+                results = zip(*load_program(code)([test[0] for test in tests], budget))
+            else:
+                results = (run_test(code, test[0], i) for i, test in enumerate(tests))
+
+            for (output, cost), test in zip(results, tests):
+                outputs.append(output)
+
+                if output != test[1]:
+                    break
+
+                costs.append(cost)
+        except BaseException as error:
+            count_error(error)
+            outputs.append(None)
+
+        return costs, output_fingerprint(outputs)
+
+    # Unlike run_tests this runs every test, for the per test errors
+    def run_all_tests(
+        code: str, tests: list[tuple[list[int], list[int]]]
+    ) -> tuple[list[int], int]:
         try:
-            result = interpreter.run(code, inputs, timeout=0.1)
-            end = time.time()
-            output_queue.put((result, end - start, program_id))
-        except:
-            output_queue.put((None, None, program_id))
+            if backend == "vectorized":
+                outputs, costs = load_program(code)([test[0] for test in tests], budget)
+            else:
+                outputs, costs = [], []
+
+                for i, (inputs, _) in enumerate(tests):
+                    try:
+                        output, cost = run_test(code, inputs, i)
+                    except BaseException as error:
+                        count_error(error)
+                        output, cost = None, -1
+
+                    outputs.append(output)
+                    costs.append(cost)
+        except BaseException as error:
+            count_error(error)
+            return failed_errors(tests), output_fingerprint([None])
+
+        errors = [test_error(output, test[1]) for output, test in zip(outputs, tests)]
+        costs = [-1 if output is None else cost for output, cost in zip(outputs, costs)]
+
+        return errors + costs, output_fingerprint(outputs)
+
+    # Only the generation currently being evaluated stays attached
+    population = None
+
+    while True:
+        task = task_queue.get(True)
+
+        started = time.perf_counter_ns()
+
+        _, task_id, name, (first, last), errors = task
+
+        # Shown before attaching, so the Runner knows which task it had if
+        # this dies on the way
+        start(task_id, first)
+
+        if population is None or population.name != name:
+            if population is not None:
+                population.close()
+                population = None
+
+            try:
+                population = SharedPopulation.attach(name)
+            except FileNotFoundError:
+                # Its generation was cancelled and released already
+                first = last
+
+        for index in range(first, last):
+            start(task_id, index)
+
+            code = population.program(index)
+
+            if errors:
+                values, fingerprint = run_all_tests(code, population.tests)
+            else:
+                values, fingerprint = run_tests(code, population.tests)
+
+            population.set_result(index, values, fingerprint)
+
+        output_queue.put(("batch", task_id))
+
+        status[3] += last - first
+        status[0] = IDLE
+        status[2] += time.perf_counter_ns() - started
 
 
 class Runner:
-    def __init__(self, interpreter: Interpreter) -> None:
+    def __init__(
+        self,
+        interpreter: Interpreter,
+        backend: str = "interpreter",
+        budget: int = STEP_BUDGET,
+        optimize: bool = True,
+        chunk_size: int = CHUNK_SIZE,
+        task_timeout: float = TASK_TIMEOUT,
+        memory_limit: Optional[int] = None,
+        cpu_limit: Optional[int] = None,
+        telemetry: Optional[Telemetry] = None,
+    ) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
+
         self.interpreter = interpreter
-        self.workers = []
+        self.backend = backend
+        self.budget = budget
+        self.optimize = optimize
+        self.chunk_size = chunk_size
+        self.task_timeout = task_timeout
+        self.memory_limit = memory_limit
+        self.cpu_limit = cpu_limit
+        self.telemetry = Telemetry() if telemetry is None else telemetry
+        self.workers: list[Process] = []
+        self.statuses: list[Array] = []
+        self.seen: list[tuple[tuple[int, int, int], float]] = []
         self.task_queue = None
         self.output_queue = None
-        self.results: dict[int, tuple[list[int], int]] = {}
-        self.queued = 0
-
-    def create_workers(self, amount=1) -> None:
+        self.results: dict[int, list[int]] = {}
+        # Of the programs of the last batches, see output_fingerprint
+        self.fingerprints: dict[int, int] = {}
+        self.pending: dict[int, tuple] = {}
+        self.population: Optional[SharedPopulation] = None
+        self.population_ids: list[int] = []
+        self.next_task_id = 0
+        self.last_check = 0.0
+        # Programs that got their worker killed or crashed it
+        self.failures: list[str] = []
+        # Share of the last collect_results each worker spent working
+        self.utilization: list[float] = []
+
+    def create_workers(self, amount: Optional[int] = None) -> None:
         if len(self.workers) > 0:
             raise AlreadyExistsException()
 
         self.task_queue = Queue()
         self.output_queue = Queue()
 
+        # Workers have to share it, their own one would unlink the shared
+        # population as soon as that worker exits
+        resource_tracker.ensure_running()
+
+        if amount is None:
+            amount = available_cpus()
+
         for i in range(amount):
-            self.workers.append(
-                Process(
-                    target=work,
-                    args=(self.interpreter, self.task_queue, self.output_queue),
-                )
+            # Task id, position in the batch, then the counters named in
+            # WORKER_COUNTERS, which are kept when the worker is restarted, and
+            # the test being run
+            self.statuses.append(
+                Array("q", [IDLE, 0] + [0] * len(WORKER_COUNTERS) + [0], lock=False)
             )
-
-        for worker in self.workers:
-            worker.start()
+            self.seen.append(((IDLE, 0, 0), time.monotonic()))
+            self.workers.append(self.start_worker(i))
+
+    def start_worker(self, slot: int) -> Process:
+        self.statuses[slot][0] = IDLE
+
+        worker = Process(
+            target=work,
+            args=(
+                self.interpreter,
+                self.task_queue,
+                self.output_queue,
+                self.statuses[slot],
+                self.backend,
+                self.budget,
+                self.optimize,
+                self.memory_limit,
+                self.cpu_limit,
+            ),
+        )
+        worker.start()
+
+        return worker
 
     def kill_workers(self) -> None:
         for worker in self.workers:
             worker.kill()
 
+        for worker in self.workers:
+            worker.join()
+
         self.workers = []
+        self.statuses = []
+        self.seen = []
+        self.pending = {}
+
+        self.release_population()
+
+    def put_task(self, kind: str, *task) -> None:
+        task_id = self.next_task_id
+        self.next_task_id += 1
+
+        self.pending[task_id] = (kind, task_id, *task)
+        self.task_queue.put(self.pending[task_id])
+
+    # With errors every test is run, and the results are the error of each
+    # test followed by its cost instead of the costs of the passed tests
+    def queue_batches(
+        self,
+        programs: list[tuple[str, int]],
+        tests: list[tuple[list[int], list[int]]],
+        errors: bool = False,
+    ) -> None:
+        with self.telemetry.stage("queue"):
+            self.release_population()
+
+            self.population = SharedPopulation.create(
+                [program for program, _ in programs],
+                tests,
+                (2 if errors else 1) * len(tests) + 1,
+            )
+            self.population_ids = [program_id for _, program_id in programs]
+
+            for first, last in self.chunk_ranges(len(programs)):
+                self.put_task("batch", self.population.name, (first, last), errors)
+
+    def chunk_ranges(self, count: int) -> list[tuple[int, int]]:
+        ranges = []
+        first = 0
+
+        # Chunks shrink towards the end, so no worker is still busy with a big
+        # one while the others have nothing left to take from the queue
+        while first < count:
+            size = min(
+                self.chunk_size, (count - first) // (2 * max(len(self.workers), 1))
+            )
+            last = first + max(size, 1)
+
+            ranges.append((first, last))
+
+            first = last
+
+        return ranges
 
-    def queue_test(self, programs: list[tuple[str, int]], test: list[int]) -> None:
-        for program_id, (program, program_id) in enumerate(programs):
-            self.task_queue.put((program, test, program_id))
-            self.queued += 1
+    def release_population(self) -> None:
+        if self.population is None:
+            return
+
+        self.population.close()
+        self.population.memory.unlink()
+
+        self.population = None
+        self.population_ids = []
 
     def collect_results(self) -> None:
-        self.results = {}
+        with self.telemetry.stage("collect"):
+            self.results = {}
+            self.fingerprints = {}
+
+            started = time.monotonic()
+            busy = [status[2] for status in self.statuses]
+
+            while self.pending:
+                if time.monotonic() - self.last_check >= WATCHDOG_INTERVAL:
+                    self.check_workers()
+
+                try:
+                    _, task_id = self.output_queue.get(timeout=WATCHDOG_INTERVAL)
+                except Empty:
+                    continue
+
+                # Tasks of restarted workers were already settled
+                self.pending.pop(task_id, None)
+
+            # Workers wrote the batch results straight into the shared rows
+            for index, program_id in enumerate(self.population_ids):
+                self.results[program_id] = self.population.result(index)
+                self.fingerprints[program_id] = self.population.fingerprint(index)
+
+            self.population_ids = []
+
+            elapsed = max(time.monotonic() - started, 1e-9)
+
+            self.utilization = [
+                (status[2] - before) / 1e9 / elapsed
+                for status, before in zip(self.statuses, busy)
+            ]
+
+    # The counters of all workers added up, see WORKER_COUNTERS
+    def worker_totals(self) -> list[int]:
+        return [
+            sum(status[slot] for status in self.statuses)
+            for slot in range(2, len(WORKER_COUNTERS) + 2)
+        ]
+
+    def check_workers(self) -> None:
+        now = time.monotonic()
+        self.last_check = now
+
+        for slot, worker in enumerate(self.workers):
+            status = (
+                self.statuses[slot][0],
+                self.statuses[slot][1],
+                self.statuses[slot][TEST_SLOT],
+            )
+            seen, since = self.seen[slot]
+
+            if status != seen:
+                self.seen[slot] = (status, now)
+                since = now
+
+            stuck = status[0] != IDLE and now - since > self.test_timeout()
+
+            if worker.is_alive() and not stuck:
+                continue
+
+            worker.kill()
+            worker.join()
+
+            self.workers[slot] = self.start_worker(slot)
+            self.seen[slot] = ((IDLE, 0, 0), now)
+
+            if status[0] != IDLE:
+                self.fail_task(status[0], status[1])
+            else:
+                self.requeue_unclaimed()
+
+    # The vectorized backend runs a program on all its tests in one go, so it
+    # gets the time of all of them
+    def test_timeout(self) -> float:
+        if self.backend != "vectorized" or self.population is None:
+            return self.task_timeout
+
+        return self.task_timeout * len(self.population.tests)
+
+    def fail_task(self, task_id: int, index: int) -> None:
+        task = self.pending.pop(task_id, None)
+
+        if task is None:
+            return
+
+        _, _, name, (first, last), errors = task
+
+        self.failures.append(self.population.program(index))
+        self.population.set_result(
+            index, failed_errors(self.population.tests) if errors else []
+        )
 
-        for i in range(self.queued):
-            results, runtime, program_id = self.output_queue.get(timeout=0.2)
+        # Programs before it in the batch already have their results
+        if index + 1 < last:
+            self.put_task("batch", name, (index + 1, last), errors)
 
-            self.results[program_id] = (results, runtime)
+    # A worker can die after taking a task but before showing it, so every
+    # task no worker runs is queued again. Those still in the queue run twice,
+    # only the copy that finishes under the new id counts.
+    def requeue_unclaimed(self) -> None:
+        running = {status[0] for status in self.statuses}
 
-        self.queued = 0
+        for task_id in [task_id for task_id in self.pending if task_id not in running]:
+            kind, _, *task = self.pending.pop(task_id)
+            self.put_task(kind, *task)
 
-    def get_program_results(self, program_id: int) -> dict[int, tuple[list[int], int]]:
+    def get_program_results(self, program_id: int) -> list[int]:
         return self.results[program_id]
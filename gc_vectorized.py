@@ -0,0 +1,349 @@
+from typing import Optional
+
+import numpy as np
+
+from gc_interpreter import LOOP_ITERATION_COST, Block, Interpreter, Program
+
+INT64_MIN = np.iinfo(np.int64).min
+INT64_MAX = np.iinfo(np.int64).max
+
+# Results at or above this magnitude might not fit into an int64
+OVERFLOW_LIMIT = 2.0**62
+
+# Bases below this magnitude have an exact float64 exponent for pow_cost
+EXACT_LIMIT = 2.0**53
+
+COMPARISONS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "=": np.equal,
+    "<=": np.less_equal,
+    "<": np.less,
+    "!=": np.not_equal,
+}
+
+
+class VectorizedInterpreter:
+    def __init__(self, interpreter: Interpreter):
+        self.interpreter = interpreter
+        self.lanes = 0
+        self.values: dict[int, np.ndarray] = {}
+        self.defined: dict[int, np.ndarray] = {}
+        self.alive = None
+        self.failed = None
+        self.bailed = None
+        self.inputs = None
+        self.input_count = None
+        self.outputs = []
+        self.cost = None
+        self.budget = INT64_MAX
+        self.actions = {
+            "SET": self.set_variable,
+            "COPY": self.copy_variable,
+            "YIELD": self.yield_variable,
+            "INPUT": self.input_number,
+            "ADD": self.add_variables,
+            "SUB": self.subtract_variables,
+            "MUL": self.multiply_variables,
+            "DIV": self.divide_variables,
+            "MOD": self.mod_variables,
+            "POW": self.pow_variables,
+            "IF": self.if_comp,
+            "LOOP": self.loop,
+            "MULTI": self.multi,
+        }
+
+    def execute(
+        self,
+        program: Program,
+        inputs: list[list[int]],
+        budget: Optional[int] = None,
+    ) -> tuple[list[Optional[list[int]]], list[int]]:
+        self.lanes = len(inputs)
+        self.alive = np.ones(self.lanes, dtype=bool)
+        self.failed = np.zeros(self.lanes, dtype=bool)
+        self.bailed = np.zeros(self.lanes, dtype=bool)
+        self.cost = np.zeros(self.lanes, dtype=np.int64)
+        self.budget = INT64_MAX if budget is None else budget
+
+        try:
+            self.load_inputs(inputs)
+
+            with np.errstate(all="ignore"):
+                self.execute_block(program.commands, self.alive.copy())
+
+            results = self.collect_outputs()
+            costs = self.cost.tolist()
+
+            for lane in np.flatnonzero(self.bailed).tolist():
+                try:
+                    results[lane], costs[lane] = self.interpreter.measure(
+                        program, inputs[lane], budget
+                    )
+                except Exception:
+                    results[lane] = None
+
+            return results, costs
+        finally:
+            self.values = {}
+            self.defined = {}
+            self.outputs = []
+
+    def load_inputs(self, inputs: list[list[int]]):
+        depth = max([len(lane_inputs) for lane_inputs in inputs] + [0])
+
+        self.inputs = np.zeros((self.lanes, depth), dtype=np.int64)
+        self.input_count = np.zeros(self.lanes, dtype=np.int64)
+
+        for lane, lane_inputs in enumerate(inputs):
+            if any(value < INT64_MIN or value > INT64_MAX for value in lane_inputs):
+                self.bail(self.lane_mask([lane]))
+                continue
+
+            self.inputs[lane, : len(lane_inputs)] = lane_inputs
+            self.input_count[lane] = len(lane_inputs)
+
+    def collect_outputs(self) -> list[Optional[list[int]]]:
+        results = [[] for _ in range(self.lanes)]
+
+        for lanes, values in self.outputs:
+            for lane, value in zip(lanes.tolist(), values.tolist()):
+                results[lane].append(value)
+
+        for lane in np.flatnonzero(self.failed | self.bailed).tolist():
+            results[lane] = None
+
+        return results
+
+    def lane_mask(self, lanes) -> np.ndarray:
+        mask = np.zeros(self.lanes, dtype=bool)
+        mask[lanes] = True
+
+        return mask
+
+    def fail(self, lanes: np.ndarray):
+        self.failed |= lanes
+        self.alive &= ~lanes
+
+    def bail(self, lanes: np.ndarray):
+        self.bailed |= lanes
+        self.alive &= ~lanes
+
+    def variable(self, slot: int) -> tuple[np.ndarray, np.ndarray]:
+        if slot not in self.values:
+            self.values[slot] = np.zeros(self.lanes, dtype=np.int64)
+            self.defined[slot] = np.zeros(self.lanes, dtype=bool)
+
+        return self.values[slot], self.defined[slot]
+
+    def charge(self, mask: np.ndarray, cost) -> np.ndarray:
+        self.cost[mask] += cost
+
+        over_budget = mask & (self.cost > self.budget)
+
+        if not over_budget.any():
+            return mask
+
+        self.fail(over_budget)
+
+        return mask & ~over_budget
+
+    def execute_block(self, block: Block, mask: np.ndarray):
+        for action, arguments, blocks, cost in block:
+            mask = mask & self.alive
+
+            if not mask.any():
+                return
+
+            if cost:
+                mask = self.charge(mask, cost)
+
+            if action in self.actions:
+                self.actions[action](arguments, blocks, mask)
+
+    def set_variable(self, args, blocks, mask):
+        var_name, value = args
+
+        try:
+            value = int(value)
+        except ValueError:
+            self.fail(mask)
+            return
+
+        if value < INT64_MIN or value > INT64_MAX:
+            self.bail(mask)
+            return
+
+        values, defined = self.variable(var_name)
+
+        values[mask] = value
+        defined[mask] = True
+
+    def copy_variable(self, args, blocks, mask):
+        to_var, from_var = args
+
+        to_values, to_defined = self.variable(to_var)
+        from_values, from_defined = self.variable(from_var)
+
+        mask = mask & to_defined & from_defined
+
+        to_values[mask] = from_values[mask]
+
+    def yield_variable(self, args, blocks, mask):
+        values, defined = self.variable(args[0])
+
+        lanes = np.flatnonzero(mask & defined)
+
+        if len(lanes) > 0:
+            self.outputs.append((lanes, values[lanes]))
+
+    def input_number(self, args, blocks, mask):
+        values, defined = self.variable(args[0])
+
+        lanes = np.flatnonzero(mask & defined & (self.input_count > 0))
+
+        self.input_count[lanes] -= 1
+        values[lanes] = self.inputs[lanes, self.input_count[lanes]]
+
+    def arithmetic(self, args, blocks, mask, threshold, operation):
+        var1, var2, to = args
+
+        values1, defined1 = self.variable(var1)
+        values2, defined2 = self.variable(var2)
+        to_values, to_defined = self.variable(to)
+
+        invalid = mask & (
+            ~defined1 | (values1 > threshold) | ~defined2 | (values2 > threshold)
+        )
+
+        if operation is np.power:
+            invalid |= mask & (values2 > 100)
+
+        self.fail(invalid)
+
+        lanes = np.flatnonzero(mask & ~invalid & to_defined)
+
+        if len(lanes) == 0:
+            return
+
+        left = values1[lanes]
+        right = values2[lanes]
+
+        failed, bailed = self.check_operation(left, right, operation)
+
+        self.fail(self.lane_mask(lanes[failed]))
+        self.bail(self.lane_mask(lanes[bailed]))
+
+        ok = ~(failed | bailed)
+
+        mask = self.charge(
+            self.lane_mask(lanes[ok]),
+            self.operation_cost(left[ok], right[ok], operation),
+        )
+
+        to_values[mask] = operation(values1[mask], values2[mask])
+
+    def check_operation(self, left, right, operation):
+        failed = np.zeros(len(left), dtype=bool)
+
+        if operation is np.add:
+            result = left + right
+            bailed = ((left ^ result) & (right ^ result)) < 0
+        elif operation is np.subtract:
+            result = left - right
+            bailed = ((left ^ right) & (left ^ result)) < 0
+        elif operation is np.multiply:
+            bailed = np.abs(left.astype(np.float64) * right) >= OVERFLOW_LIMIT
+        elif operation is np.power:
+            # Negative exponents give floats, leave those to the Interpreter
+            magnitude = np.abs(left.astype(np.float64))
+            bailed = (
+                (right < 0)
+                | (right * np.log2(np.maximum(magnitude, 1)) >= 62)
+                | (magnitude >= EXACT_LIMIT)
+            )
+        else:
+            failed = right == 0
+            bailed = (left == INT64_MIN) & (right == -1)
+
+        return failed, bailed
+
+    def operation_cost(self, left, right, operation) -> np.ndarray:
+        # Same as size_cost and pow_cost, only INT64_MIN is wider than 63 bits
+        if operation is np.power:
+            bit_length = np.frexp(np.abs(left.astype(np.float64)))[1]
+
+            return np.where(right > 0, (right * bit_length) >> 6, 0)
+
+        return (left == INT64_MIN).astype(np.int64) + (right == INT64_MIN)
+
+    def add_variables(self, args, blocks, mask):
+        self.arithmetic(args, blocks, mask, 10**15, np.add)
+
+    def subtract_variables(self, args, blocks, mask):
+        self.arithmetic(args, blocks, mask, 10**15, np.subtract)
+
+    def multiply_variables(self, args, blocks, mask):
+        self.arithmetic(args, blocks, mask, 10**10, np.multiply)
+
+    def divide_variables(self, args, blocks, mask):
+        self.arithmetic(args, blocks, mask, 10**10, np.floor_divide)
+
+    def mod_variables(self, args, blocks, mask):
+        self.arithmetic(args, blocks, mask, 10**10, np.remainder)
+
+    def pow_variables(self, args, blocks, mask):
+        self.arithmetic(args, blocks, mask, 10**8, np.power)
+
+    def if_comp(self, args, blocks, mask):
+        left_var, operator, right_var = args
+
+        left, left_defined = self.variable(left_var)
+        right, right_defined = self.variable(right_var)
+
+        mask = mask & left_defined & right_defined
+
+        if operator in COMPARISONS:
+            if_result = COMPARISONS[operator](left, right)
+        else:
+            if_result = np.zeros(self.lanes, dtype=bool)
+
+        if (mask & if_result).any():
+            self.execute_block(blocks[0], mask & if_result)
+
+        if blocks[1] and (mask & ~if_result).any():
+            self.execute_block(blocks[1], mask & ~if_result)
+
+    def loop(self, args, blocks, mask):
+        count_var, index_var = args
+
+        count, count_defined = self.variable(count_var)
+        index, index_defined = self.variable(index_var)
+
+        mask = mask & count_defined & index_defined
+
+        self.fail(mask & (count > 10**5))
+
+        mask = mask & self.alive
+
+        if not mask.any():
+            return
+
+        index_before = index.copy()
+        trip_count = np.where(mask, count, 0)
+
+        for i in range(trip_count.max()):
+            active = mask & (trip_count > i) & self.alive
+
+            if not active.any():
+                break
+
+            index[active] = i + 1
+            active = self.charge(active, LOOP_ITERATION_COST)
+            self.execute_block(blocks[0], active)
+
+        index[mask] = index_before[mask]
+
+    def multi(self, args, blocks, mask):
+        self.execute_block(blocks[0], mask)
+        self.execute_block(blocks[1], mask & self.alive)
@@ -1,7 +1,10 @@
 from typing import Literal
 from time import sleep
+import argparse
 import os
 
+from gc_checkpoint import CHECKPOINT_INTERVAL, CHECKPOINT_PATH
+
 CHARACTERS = {
     "INFO": """########  
 #  ^ ^ #  
@@ -71,112 +74,165 @@ def print_message(
     print(wrap_escape("\n".join(lines), CHARACTER_STYLES[print_type]))
 
 
-print()
-
-print_message("Welcome to Genetic Programming!\nLet's set everything up.", 1)
+def ask_tests() -> list:
+    print()
 
-print()
+    print_message("Welcome to Genetic Programming!\nLet's set everything up.", 1)
 
-print(wrap_escape("  How many tasks would you like to add?", "1m"))
-try:
-    tests_number = input("> " + ESCAPE + "33m")
-except KeyboardInterrupt:
-    print(RESET + "\nBye.")
-    exit()
+    print()
 
-print(RESET + "\n")
+    print(wrap_escape("  How many tasks would you like to add?", "1m"))
+    try:
+        tests_number = input("> " + ESCAPE + "33m")
+    except KeyboardInterrupt:
+        print(RESET + "\nBye.")
+        exit()
 
-try:
-    tests_number = int(tests_number)
-except ValueError:
-    print_message("That doesn't look like a number!", 1, "ERROR")
-    exit()
+    print(RESET + "\n")
 
+    try:
+        tests_number = int(tests_number)
+    except ValueError:
+        print_message("That doesn't look like a number!", 1, "ERROR")
+        exit()
 
-print(wrap_escape("Okay, let's see them!", "1m"))
+    print(wrap_escape("Okay, let's see them!", "1m"))
 
-print()
+    print()
 
-print(
-    wrap_escape(
-        "Each program can take multiple inputs and multiple outputs, but the more you add, the harder it will be for it find a solution.",
-        "2m",
+    print(
+        wrap_escape(
+            "Each program can take multiple inputs and multiple outputs, but the more you add, the harder it will be for it find a solution.",
+            "2m",
+        )
     )
-)
 
-print()
+    print()
 
-print(
-    wrap_escape(
-        "Provide them in this format: INPUT0 INPUT1 = OUTPUT1 OUTPUT2 OUTPUT3\nFor example: 1 2 = 3 - this would be a program which adds the two inputs.",
-        "2m",
+    print(
+        wrap_escape(
+            "Provide them in this format: INPUT0 INPUT1 = OUTPUT1 OUTPUT2 OUTPUT3\nFor example: 1 2 = 3 - this would be a program which adds the two inputs.",
+            "2m",
+        )
     )
-)
 
-print()
+    print()
 
-tests = []
+    tests = []
 
-for i in range(tests_number):
-    try:
-        test = input(
-            f"{str(i+1).zfill(len(str(tests_number)))}/{tests_number} > "
-            + ESCAPE
-            + "33m"
-        )
-    except KeyboardInterrupt:
-        print(RESET + "\nBye.")
-        exit()
+    for i in range(tests_number):
+        try:
+            test = input(
+                f"{str(i+1).zfill(len(str(tests_number)))}/{tests_number} > "
+                + ESCAPE
+                + "33m"
+            )
+        except KeyboardInterrupt:
+            print(RESET + "\nBye.")
+            exit()
 
-    test = test.split("=")
+        test = test.split("=")
 
-    if len(test) != 2:
-        print("\n")
-        print_message("Hmm... I don't understand that.", 1, "ERROR")
-        exit()
+        if len(test) != 2:
+            print("\n")
+            print_message("Hmm... I don't understand that.", 1, "ERROR")
+            exit()
 
-    try:
-        test = [[int(value) for value in x.strip().split(" ")] for x in test]
-    except ValueError:
-        print("\n")
-        print_message("Hmm... I don't understand that.", 1, "ERROR")
-        exit()
+        try:
+            test = [[int(value) for value in x.strip().split(" ")] for x in test]
+        except ValueError:
+            print("\n")
+            print_message("Hmm... I don't understand that.", 1, "ERROR")
+            exit()
+
+        tests.append(test)
+
+        print(RESET)
 
-    tests.append(test)
+    print_message("Great, I'll start the evolution now!", 1)
 
-    print(RESET)
+    sleep(2)
 
-print_message("Great, I'll start the evolution now!", 1)
+    print()
 
-sleep(2)
+    return tests
 
-print()
+
+parser = argparse.ArgumentParser(description="Evolve programs that pass your tests")
+parser.add_argument(
+    "--resume",
+    nargs="?",
+    const=CHECKPOINT_PATH,
+    help=f"Continue from a checkpoint ({CHECKPOINT_PATH}) instead of asking for tests",
+)
+parser.add_argument("--telemetry", help="Append per generation metrics to this file")
+parser.add_argument(
+    "--seed", type=int, help="Seed the run, so it can be repeated (ignored on resume)"
+)
+args = parser.parse_args()
+
+if args.resume is None:
+    tests = ask_tests()
 
 
 from gc_evolution import (
     create_population,
+    FitnessCache,
     Interpreter,
     Runner,
+    deduplicate,
     evaluate_population,
     reproduce,
     mutate,
+    RNG,
+    seed_rng,
+    GeneratorProcess,
+    ACTION_WEIGHTS,
 )
+from gc_checkpoint import CheckpointWriter, load_checkpoint, runner_config
+from gc_archive import HallOfFame
+from gc_telemetry import Telemetry
 
-population = create_population(10000)
+interpreter = Interpreter(False)
 
-generation = 0
+telemetry = Telemetry(args.telemetry)
 
-interpreter = Interpreter(False)
+if args.resume is None:
+    seed_rng(args.seed)
+
+    with telemetry.stage("create_population"):
+        population = create_population(10000)
+
+    generation = 0
 
-runner = Runner(interpreter)
+    runner = Runner(interpreter, telemetry=telemetry)
+else:
+    checkpoint = load_checkpoint(args.resume)
 
-runner.create_workers(1)
+    population = checkpoint.population
+    tests = checkpoint.tests
+
+    generation = checkpoint.generation
+
+    RNG.setstate(checkpoint.random_state)
+
+    runner = Runner(interpreter, **checkpoint.config, telemetry=telemetry)
+
+runner.create_workers()
+
+generator_process = GeneratorProcess(ACTION_WEIGHTS)
+
+cache = FitnessCache()
 
 if not os.path.exists("outputs"):
     os.mkdir("outputs")
 
+writer = CheckpointWriter()
+
+hall_of_fame = HallOfFame(generation=generation)
+
 while True:
-    population, fitness_scores = evaluate_population(population, runner, tests)
+    population, fitness_scores = evaluate_population(population, runner, tests, cache)
 
     print(
         f"Best of generation {generation}:",
@@ -185,9 +241,20 @@ while True:
         fitness_scores[2],
     )
 
-    with open(f"outputs/g{generation}.gc", "w") as f:
-        f.write(population[0])
+    with telemetry.stage("output"):
+        hall_of_fame.consider(generation, population[0])
+
+    # Reproducing and checkpointing count towards the next generation
+    telemetry.emit(generation, population, fitness_scores, runner)
 
-    population = reproduce(population, mutate)
+    with telemetry.stage("deduplicate"):
+        parents = deduplicate(population)
+
+    with telemetry.stage("reproduce"):
+        population = reproduce(parents, mutate, generator_process, len(population))
 
     generation += 1
+
+    if generation % CHECKPOINT_INTERVAL == 0:
+        with telemetry.stage("output"):
+            writer.save(generation, population, tests, runner_config(runner))